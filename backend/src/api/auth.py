@@ -1,13 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Body
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from typing import Dict, Any, Optional
+import asyncio
+import logging
 
-from ..db.firebase import FirestoreDB, FirebaseAuth
+from ..db.firebase import get_firestore_db, get_firebase_auth, build_default_settings, TRANSIENT_FIRESTORE_ERRORS
 from ..models.user import UserCreate, UserLogin, UserResponse, PasswordReset
+from ..core.auth_cache import verify_token_cached
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
-firebase_auth = FirebaseAuth()
-firestore_db = FirestoreDB()
+firebase_auth = get_firebase_auth()
+firestore_db = get_firestore_db()
 
 # OAuth2 password bearer for token authentication
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
@@ -17,19 +22,23 @@ async def register_user(user_data: UserCreate):
     """Register a new user"""
     try:
         # Create user in Firebase Auth
-        user_id = await firebase_auth.create_user(user_data.email, user_data.password)
+        auth_user = await firebase_auth.create_user(user_data.email, user_data.password, user_data.display_name)
+        user_id = auth_user["uid"]
         
-        # Create user document in Firestore
+        # Create user and default settings documents in one batched commit
         user_dict = {
             "uid": user_id,
             "email": user_data.email,
             "displayName": user_data.display_name,
             "role": "user"
         }
-        await firestore_db.create_user(user_dict)
+        default_settings = build_default_settings(user_id, user_data.email, user_data.display_name)
         
-        # Generate token
-        token = await firebase_auth.create_custom_token(user_id)
+        # Minting the token doesn't depend on the Firestore write
+        _, token = await asyncio.gather(
+            firestore_db.create_user_with_settings(user_dict, default_settings),
+            firebase_auth.create_custom_token(user_id)
+        )
         
         return {
             "uid": user_id,
@@ -37,6 +46,12 @@ async def register_user(user_data: UserCreate):
             "displayName": user_data.display_name,
             "token": token
         }
+    except TRANSIENT_FIRESTORE_ERRORS as e:
+        logger.warning(f"Registration failed, Firestore unavailable after retries: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Registration failed: service temporarily unavailable, please retry"
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -58,11 +73,11 @@ async def login_user(user_data: UserLogin):
                 detail="User not found"
             )
         
-        # Update last login timestamp
-        await firestore_db.update_user(user_id, {"lastLogin": firestore_db.server_timestamp()})
-        
-        # Generate token
-        token = await firebase_auth.create_custom_token(user_id)
+        # Generate token while updating the last login timestamp
+        token, _ = await asyncio.gather(
+            firebase_auth.create_custom_token(user_id),
+            firestore_db.update_user(user_id, {"lastLogin": firestore_db.server_timestamp()})
+        )
         
         return {
             "uid": user_id,
@@ -70,6 +85,12 @@ async def login_user(user_data: UserLogin):
             "displayName": user.get("displayName", ""),
             "token": token
         }
+    except TRANSIENT_FIRESTORE_ERRORS as e:
+        logger.warning(f"Login failed, Firestore unavailable after retries: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Login failed: service temporarily unavailable, please retry"
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -106,7 +127,8 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     """Get current user data"""
     try:
         # Verify token and get user ID
-        user_id = await firebase_auth.verify_token(token)
+        token_data = await verify_token_cached(token, firebase_auth.verify_token)
+        user_id = token_data.get("uid")
         
         # Get user data from Firestore
         user = await firestore_db.get_user(user_id)
@@ -122,6 +144,12 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
             "displayName": user.get("displayName", ""),
             "token": token
         }
+    except TRANSIENT_FIRESTORE_ERRORS as e:
+        logger.warning(f"Authentication failed, Firestore unavailable after retries: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication failed: service temporarily unavailable, please retry"
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -1,30 +1,69 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Body, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Query, Response, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from typing import List, Optional, Dict, Any, Tuple
 import uuid
 from datetime import datetime
 import logging
+import random
 import traceback
 import json
+import asyncio
+import hashlib
+from collections import defaultdict
+from cachetools import TTLCache
+from firebase_admin.firestore import SERVER_TIMESTAMP
 
-from ..db.firebase import FirestoreDB, FirebaseAuth
+from ..db.firebase import get_firestore_db, get_firebase_auth, TRANSIENT_FIRESTORE_ERRORS
 from ..models.chat import ChatSessionCreate, ChatSessionResponse, MessageCreate, MessageResponse, ChatSession, ChatMessage, SavedSession
-from ..services.query_engine import QueryEngine
+from ..services.query_engine import QueryEngine, RAGStatus
 from ..services.auth import get_current_user, User
 from ..utils.logging import get_logger
-from pydantic import BaseModel
+from ..utils.cache import AsyncTTLCache
+from pydantic import BaseModel, ConfigDict, Field
 from ..core.dependencies import get_chatbot_or_404
+from ..core.auth_cache import verify_token_cached
 
 # Configure logger
 logger = get_logger(__name__)
 
 router = APIRouter()
-firestore_db = FirestoreDB()
-firebase_auth = FirebaseAuth()
+firestore_db = get_firestore_db()
+firebase_auth = get_firebase_auth()
 query_engine = QueryEngine()
 
+# Fraction of requests whose full payload is logged at DEBUG level
+VERBOSE_LOG_SAMPLE_RATE = 0.01
+
+# Recently seen session -> chatbot mappings, so send_message can fetch the
+# session and its chatbot concurrently
+_session_chatbot_ids = TTLCache(maxsize=10_000, ttl=600)
+
+class _WidgetSessionCache(TTLCache):
+    """TTLCache that releases a session's lock when the session is evicted"""
+
+    def popitem(self):
+        key, value = super().popitem()
+        _session_locks.pop(key, None)
+        return key, value
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        for key, _ in expired:
+            _session_locks.pop(key, None)
+        return expired
+
+# Recent widget answers keyed by chatbot settings and message, so double
+# submits and bursts of the same question run retrieval and the LLM once
+_widget_answers = AsyncTTLCache(maxsize=1024, ttl=30)
+
+# In-memory storage for widget sessions (would be replaced by database in production)
+_session_locks: defaultdict = defaultdict(asyncio.Lock)
+widget_sessions = _WidgetSessionCache(maxsize=10_000, ttl=3600)
+
 # Get current user ID from token
 async def get_current_user_id(token: str = Depends(firebase_auth.oauth2_scheme)):
-    return await firebase_auth.verify_token(token)
+    token_data = await verify_token_cached(token, firebase_auth.verify_token)
+    return token_data.get("uid")
 
 @router.post("/sessions", response_model=ChatSessionResponse, status_code=status.HTTP_201_CREATED)
 async def create_chat_session(session_data: ChatSessionCreate, user_id: str = Depends(get_current_user_id)):
@@ -38,24 +77,29 @@ async def create_chat_session(session_data: ChatSessionCreate, user_id: str = De
                 detail="Chatbot not found"
             )
         
-        # Generate unique ID for chat session
-        session_id = str(uuid.uuid4())
+        # Create chat session in Firestore; timestamps are set server-side
+        session_id = await firestore_db.create_chat_session({
+            "chatbotId": session_data.chatbotId,
+            "userId": user_id
+        })
         
-        # Create chat session in Firestore
-        session_dict = {
+        now = datetime.now()
+        return {
             "id": session_id,
             "chatbotId": session_data.chatbotId,
             "userId": user_id,
-            "createdAt": datetime.now(),
-            "updatedAt": datetime.now(),
+            "createdAt": now,
+            "updatedAt": now,
             "messages": []
         }
-        
-        await firestore_db.create_chat_session(session_dict)
-        
-        return session_dict
     except HTTPException:
         raise
+    except TRANSIENT_FIRESTORE_ERRORS as e:
+        logger.warning(f"Failed to create chat session, Firestore unavailable after retries: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Failed to create chat session: service temporarily unavailable, please retry"
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -63,11 +107,28 @@ async def create_chat_session(session_data: ChatSessionCreate, user_id: str = De
         )
 
 @router.get("/sessions", response_model=List[ChatSessionResponse])
-async def list_chat_sessions(user_id: str = Depends(get_current_user_id)):
-    """List all chat sessions for the current user"""
+async def list_chat_sessions(
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    user_id: str = Depends(get_current_user_id)
+):
+    """List a page of chat sessions for the current user, newest first
+    
+    The ID to pass as `cursor` for the next page is returned in the
+    X-Next-Cursor header when more sessions may follow.
+    """
     try:
-        sessions = await firestore_db.list_chat_sessions(user_id)
+        sessions = await firestore_db.list_chat_sessions(user_id, limit=limit, cursor=cursor)
+        if len(sessions) == limit:
+            response.headers["X-Next-Cursor"] = sessions[-1]["id"]
         return sessions
+    except TRANSIENT_FIRESTORE_ERRORS as e:
+        logger.warning(f"Failed to list chat sessions, Firestore unavailable after retries: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Failed to list chat sessions: service temporarily unavailable, please retry"
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -78,7 +139,10 @@ async def list_chat_sessions(user_id: str = Depends(get_current_user_id)):
 async def get_chat_session(session_id: str, user_id: str = Depends(get_current_user_id)):
     """Get chat session details"""
     try:
-        session = await firestore_db.get_chat_session(session_id)
+        # Only the response fields are read, not the legacy message history
+        session = await firestore_db.get_chat_session_meta(
+            session_id, ["id", "chatbotId", "userId", "createdAt", "updatedAt"]
+        )
         
         if not session:
             raise HTTPException(
@@ -96,6 +160,12 @@ async def get_chat_session(session_id: str, user_id: str = Depends(get_current_u
         return session
     except HTTPException:
         raise
+    except TRANSIENT_FIRESTORE_ERRORS as e:
+        logger.warning(f"Failed to get chat session, Firestore unavailable after retries: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Failed to get chat session: service temporarily unavailable, please retry"
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -103,11 +173,32 @@ async def get_chat_session(session_id: str, user_id: str = Depends(get_current_u
         )
 
 @router.post("/sessions/{session_id}/messages", response_model=MessageResponse)
-async def send_message(session_id: str, message_data: MessageCreate, user_id: str = Depends(get_current_user_id)):
-    """Send a message in a chat session"""
+async def send_message(
+    session_id: str,
+    message_data: MessageCreate,
+    background_tasks: BackgroundTasks,
+    stream: bool = Query(False),
+    user_id: str = Depends(get_current_user_id)
+):
+    """Send a message in a chat session
+    
+    With `stream=true` the reply is sent as server-sent events while it is
+    generated, and stored once the stream completes.
+    """
     try:
+        # Issue the session and chatbot reads together when the session's
+        # chatbot is already known from a previous message
+        cached_chatbot_id = _session_chatbot_ids.get(session_id)
+        if cached_chatbot_id:
+            chat_session, chatbot = await asyncio.gather(
+                firestore_db.get_chat_session_meta(session_id),
+                firestore_db.get_chatbot_cached(cached_chatbot_id)
+            )
+        else:
+            chat_session = await firestore_db.get_chat_session_meta(session_id)
+            chatbot = None
+        
         # Check if chat session exists and belongs to user
-        chat_session = await firestore_db.get_chat_session(session_id)
         if not chat_session:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -127,9 +218,11 @@ async def send_message(session_id: str, message_data: MessageCreate, user_id: st
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Chat session has no associated chatbot"
             )
+        _session_chatbot_ids[session_id] = chatbot_id
         
         # Get chatbot
-        chatbot = await firestore_db.get_chatbot(chatbot_id)
+        if chatbot_id != cached_chatbot_id:
+            chatbot = await firestore_db.get_chatbot_cached(chatbot_id)
         if not chatbot:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -146,36 +239,54 @@ async def send_message(session_id: str, message_data: MessageCreate, user_id: st
         # Get documents associated with chatbot
         document_ids = chatbot.get('documents', [])
         
-        # Get chat messages
-        messages = chat_session.get('messages', [])
-        
-        # Add user message to chat session
+        # Firestore stamps the user message with its commit time, which
+        # precedes the assistant's
         user_message = {
             "role": "user",
             "content": message_data.content,
-            "timestamp": datetime.now()
+            "timestamp": SERVER_TIMESTAMP
         }
         
-        messages.append(user_message)
-        
-        # Initialize query engine
-        query_engine = QueryEngine()
-        
-        # Generate response using query engine
-        response_text, sources, tokens, rag_status = await query_engine.query(
-            query=message_data.content,
-            document_ids=document_ids,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            model=model,
-            instructions=instructions
+        if stream:
+            reply: Dict[str, Any] = {}
+            
+            async def event_stream():
+                async for event in query_engine.stream_query(
+                    query=message_data.content,
+                    document_ids=document_ids,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    model=model,
+                    instructions=instructions
+                ):
+                    if event.get("done"):
+                        reply.update(event)
+                    yield f"data: {json.dumps(event)}\n\n"
+            
+            # Background tasks run in order after the stream is sent
+            background_tasks.add_task(firestore_db.add_message, session_id, user_message)
+            background_tasks.add_task(_store_streamed_reply, session_id, reply, temperature)
+            return StreamingResponse(event_stream(), media_type="text/event-stream")
+        
+        # Store the user message while the response is generated
+        _, (response_text, sources, tokens, rag_status) = await asyncio.gather(
+            firestore_db.add_message(session_id, user_message),
+            query_engine.query(
+                query=message_data.content,
+                document_ids=document_ids,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                model=model,
+                instructions=instructions
+            )
         )
         
-        # Create assistant message
+        # Store assistant message after the response is sent
         assistant_message = {
+            "id": str(uuid.uuid4()),
             "role": "assistant",
             "content": response_text,
-            "timestamp": datetime.now(),
+            "timestamp": SERVER_TIMESTAMP,
             "metadata": {
                 "temperature": temperature,
                 "tokens": tokens,
@@ -183,31 +294,61 @@ async def send_message(session_id: str, message_data: MessageCreate, user_id: st
                 "rag_status": rag_status
             }
         }
+        background_tasks.add_task(firestore_db.add_message, session_id, assistant_message)
         
-        # Add assistant message to chat session
-        messages.append(assistant_message)
-        
-        # Update chat session with assistant message
-        await firestore_db.update_chat_session(session_id, {
-            "messages": messages,
-            "updatedAt": datetime.now()
-        })
-        
-        return assistant_message
+        # The stored timestamp is only known server-side; report local time
+        return {**assistant_message, "timestamp": datetime.now()}
     except HTTPException:
         raise
+    except TRANSIENT_FIRESTORE_ERRORS as e:
+        logger.warning(f"Failed to send message, Firestore unavailable after retries: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Failed to send message: service temporarily unavailable, please retry"
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Failed to send message: {str(e)}"
         )
 
+async def _store_streamed_reply(session_id: str, reply: Dict[str, Any], temperature: float):
+    """Store the assistant message assembled from a streamed response"""
+    if not reply:
+        logger.warning(f"Stream for session {session_id} ended without a reply")
+        return
+    
+    await firestore_db.add_message(session_id, {
+        "role": "assistant",
+        "content": reply["response"],
+        "timestamp": SERVER_TIMESTAMP,
+        "metadata": {
+            "temperature": temperature,
+            "tokens": reply["tokens"],
+            "sources": reply["sources"],
+            "rag_status": reply["rag_status"]
+        }
+    })
+
 @router.get("/sessions/{session_id}/messages", response_model=List[MessageResponse])
-async def get_chat_history(session_id: str, user_id: str = Depends(get_current_user_id)):
-    """Get chat history for a session"""
+async def get_chat_history(
+    session_id: str,
+    response: Response,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    user_id: str = Depends(get_current_user_id)
+):
+    """Get a page of chat history for a session
+    
+    The ID to pass as `cursor` for the next page is returned in the
+    X-Next-Cursor header when more messages may follow.
+    """
     try:
-        # Get chat session
-        session = await firestore_db.get_chat_session(session_id)
+        # Load ownership fields and the requested page together
+        session, messages = await asyncio.gather(
+            firestore_db.get_chat_session_meta(session_id),
+            firestore_db.list_messages(session_id, limit=limit, before=cursor)
+        )
         
         if not session:
             raise HTTPException(
@@ -222,10 +363,23 @@ async def get_chat_history(session_id: str, user_id: str = Depends(get_current_u
                 detail="Not authorized to access this chat session"
             )
         
-        # Return messages
-        return session.get("messages", [])
+        # Sessions created before messages moved to a subcollection
+        if not messages and not cursor:
+            legacy_session = await firestore_db.get_chat_session(session_id)
+            messages = (legacy_session or {}).get("messages", [])[:limit]
+        
+        if len(messages) == limit and messages[-1].get("id"):
+            response.headers["X-Next-Cursor"] = messages[-1]["id"]
+        
+        return messages
     except HTTPException:
         raise
+    except TRANSIENT_FIRESTORE_ERRORS as e:
+        logger.warning(f"Failed to get chat history, Firestore unavailable after retries: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Failed to get chat history: service temporarily unavailable, please retry"
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -237,7 +391,7 @@ async def delete_chat_session(session_id: str, user_id: str = Depends(get_curren
     """Delete a chat session"""
     try:
         # Get chat session
-        session = await firestore_db.get_chat_session(session_id)
+        session = await firestore_db.get_chat_session_meta(session_id)
         
         if not session:
             raise HTTPException(
@@ -252,12 +406,21 @@ async def delete_chat_session(session_id: str, user_id: str = Depends(get_curren
                 detail="Not authorized to delete this chat session"
             )
         
-        # Delete chat session
-        await firestore_db.delete_chat_session(session_id)
+        # Delete chat session and its messages
+        await asyncio.gather(
+            firestore_db.delete_chat_session(session_id),
+            firestore_db.delete_messages_subcollection(session_id)
+        )
         
         return None
     except HTTPException:
         raise
+    except TRANSIENT_FIRESTORE_ERRORS as e:
+        logger.warning(f"Failed to delete chat session, Firestore unavailable after retries: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Failed to delete chat session: service temporarily unavailable, please retry"
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -265,12 +428,13 @@ async def delete_chat_session(session_id: str, user_id: str = Depends(get_curren
         )
 
 @router.post("/widget/{chatbot_id}")
+@router.post("/widget/{chatbot_id}/message")
 async def chat_with_widget(chatbot_id: str, request_data: dict):
     """
     Chat with a chatbot through the website widget (no authentication required)
     """
-    logger.info(f"Widget chat request for chatbot: {chatbot_id}")
-    logger.info(f"Request data: {request_data}")
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < VERBOSE_LOG_SAMPLE_RATE:
+        logger.debug("widget_chat_payload", extra={"chatbot_id": chatbot_id, "payload": request_data})
     
     try:
         # Extract the message and session ID
@@ -288,7 +452,7 @@ async def chat_with_widget(chatbot_id: str, request_data: dict):
                 "chatbot_id": chatbot_id,
                 "messages": []
             }
-            logger.info(f"Created new widget session: {session_id}")
+            logger.info("widget_session_created", extra={"chatbot_id": chatbot_id, "session_id": session_id})
         elif session_id not in widget_sessions:
             raise HTTPException(status_code=404, detail="Session not found")
         
@@ -299,40 +463,55 @@ async def chat_with_widget(chatbot_id: str, request_data: dict):
         if session["chatbot_id"] != chatbot_id:
             raise HTTPException(status_code=400, detail="Invalid session for this chatbot")
         
-        # Get the chatbot configuration
-        chatbot = await get_chatbot_or_404(chatbot_id)
-        
-        # Get settings from chatbot
-        settings = chatbot.get("settings", {})
-        temperature = settings.get("temperature", 0.7)
-        instructions = settings.get("instructions", "")
-        documents = chatbot.get("documents", [])
-        
-        # Initialize query engine with proper configuration
-        query_engine = QueryEngine(
-            temperature=temperature,
-            instructions=instructions
-        )
-        
-        # Generate response using query method which handles context properly
-        response_text, sources, tokens = await query_engine.query(
-            query=message,
-            document_ids=documents,
-            chat_history=session["messages"]
-        )
-        
-        # Update session history
-        session["messages"].append({
-            "role": "user",
-            "content": message
-        })
-        session["messages"].append({
-            "role": "assistant",
-            "content": response_text
+        # Serialize turns within a session so history appends don't interleave
+        async with _session_locks[session_id]:
+            # Get the chatbot configuration
+            chatbot = await get_chatbot_or_404(chatbot_id)
+        
+            # Get settings from chatbot
+            settings = chatbot.get("settings", {})
+            temperature = settings.get("temperature", 0.7)
+            instructions = settings.get("instructions", "")
+            documents = chatbot.get("documents", [])
+        
+            # Generate response using query method which handles context properly.
+            # Identical concurrent or repeated questions share one answer. The
+            # key covers the settings and documents the answer depends on, so
+            # editing the chatbot or assigning documents takes effect at once.
+            answer_key = hashlib.sha256(json.dumps(
+                [chatbot_id, documents, temperature, instructions, message]
+            ).encode()).hexdigest()
+            response_text, sources, tokens, rag_status = await _widget_answers.get_or_fetch(
+                answer_key,
+                lambda: query_engine.query(
+                    query=message,
+                    document_ids=documents,
+                    temperature=temperature,
+                    instructions=instructions
+                )
+            )
+            # Failures come back as an apology rather than an exception; don't
+            # serve one transient error to every identical question
+            if rag_status == RAGStatus.ERROR:
+                _widget_answers.invalidate(answer_key)
+        
+            # Update session history
+            session["messages"].append({
+                "role": "user",
+                "content": message
+            })
+            session["messages"].append({
+                "role": "assistant",
+                "content": response_text
+            })
+        
+        logger.info("widget_chat", extra={
+            "chatbot_id": chatbot_id,
+            "msg_len": len(message),
+            "response_len": len(response_text),
+            "sources": len(sources)
         })
         
-        logger.info(f"Widget chat response generated for chatbot: {chatbot_id}")
-        
         # Return the response with session ID and sources
         return {
             "sessionId": session_id,
@@ -347,40 +526,50 @@ async def chat_with_widget(chatbot_id: str, request_data: dict):
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
+# Shared config: ignore unknown keys from clients and make instances immutable
+_model_config = ConfigDict(extra="ignore", populate_by_name=True, frozen=True)
+
 # Request models
 class ChatRequest(BaseModel):
+    model_config = _model_config
+
     message: str
 
 class WidgetSessionRequest(BaseModel):
-    chatbotId: Optional[str] = None
+    model_config = _model_config
 
-class WidgetMessageRequest(BaseModel):
-    sessionId: str
-    message: str
+    chatbotId: Optional[str] = None
 
 # Response models
-class ChatResponse(BaseModel):
-    response: str
-    sources: List[Dict[str, Any]] = []
-
 class SessionResponse(BaseModel):
+    model_config = _model_config
+
     sessionId: str
     welcomeMessage: Optional[str] = None
 
+class PreviewSettings(BaseModel):
+    model_config = _model_config
+
+    temperature: float = 0.7
+    maxTokens: int = 1024
+    model: str = "llama3-70b-8192"
+    instructions: Optional[str] = None
+
 class PreviewRequest(BaseModel):
+    model_config = _model_config
+
     chatbotId: Optional[str] = None
     message: str
-    documents: List[str] = []
-    settings: Dict[str, Any] = {}
+    documents: List[str] = Field(default_factory=list)
+    settings: PreviewSettings = Field(default_factory=PreviewSettings)
 
 class PreviewResponse(BaseModel):
+    model_config = _model_config
+
     response: str
-    sources: List[Dict[str, Any]] = []
+    sources: List[Dict[str, Any]] = Field(default_factory=list)
     rag_status: Optional[str] = None
 
-# In-memory storage for widget sessions (would be replaced by database in production)
-widget_sessions = {}
-
 @router.post("/widget/{chatbot_id}/session", response_model=SessionResponse)
 async def create_widget_session(
     chatbot_id: str,
@@ -388,7 +577,7 @@ async def create_widget_session(
 ):
     """Create a new chat session for the widget"""
     try:
-        logger.info(f"Creating widget session for chatbot: {chatbot_id}")
+        logger.debug("Creating widget session for chatbot: %s", chatbot_id)
         
         # Create a session ID
         session_id = str(uuid.uuid4())
@@ -403,7 +592,7 @@ async def create_widget_session(
         # to get a welcome message and other settings
         welcome_message = "Hi there! How can I help you today?"
         
-        logger.info(f"Widget session created: {session_id}")
+        logger.debug("Widget session created: %s", session_id)
         
         return SessionResponse(
             sessionId=session_id,
@@ -413,79 +602,19 @@ async def create_widget_session(
         logger.error(f"Error creating widget session: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to create session: {str(e)}")
 
-@router.post("/widget/{chatbot_id}/message", response_model=ChatResponse)
-async def chat_with_widget(
-    chatbot_id: str,
-    request: WidgetMessageRequest = Body(...)
-):
-    """Process a message from the widget"""
-    try:
-        logger.info(f"Processing widget message for chatbot: {chatbot_id}, session: {request.sessionId}")
-        
-        # Verify session exists
-        if request.sessionId not in widget_sessions:
-            logger.error(f"Session not found: {request.sessionId}")
-            raise HTTPException(status_code=404, detail="Session not found")
-        
-        # Get session data
-        session = widget_sessions[request.sessionId]
-        
-        # Verify chatbot IDs match
-        if session["chatbot_id"] != chatbot_id:
-            logger.error(f"Chatbot ID mismatch: {session['chatbot_id']} != {chatbot_id}")
-            raise HTTPException(status_code=400, detail="Invalid session for this chatbot")
-        
-        # Initialize query engine
-        query_engine = QueryEngine()
-        
-        message = request.message
-        chat_history = session["messages"]
-        instructions = "You are a helpful chatbot assistant."  # Would come from chatbot settings
-        temperature = 0.7  # Would come from chatbot settings
-        
-        # Get context from documents
-        context = query_engine.get_context(
-            query=message,
-            documents=[]  # In production, would fetch document IDs from chatbot configuration
-        )
-        
-        # Generate response
-        response = query_engine._query_llm_only(
-            query_text=message,
-            temperature=temperature,
-            instructions=instructions
-        )
-        
-        # Update session history
-        session["messages"].append({
-            "role": "user",
-            "content": message
-        })
-        session["messages"].append({
-            "role": "assistant",
-            "content": response["response"]
-        })
-        
-        # Return response
-        return ChatResponse(
-            response=response["response"],
-            sources=[]  # In production, would extract sources from response
-        )
-    except Exception as e:
-        logger.error(f"Error processing widget message: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to process message: {str(e)}")
-
-@router.post("/chatbots/preview", response_model=PreviewResponse)
+@router.post("/chatbots/preview", response_model=PreviewResponse, response_model_exclude_none=True)
 async def preview_chatbot(
     preview_data: PreviewRequest,
     user_id: Optional[str] = Depends(get_current_user_id)
 ):
     """Preview chatbot response"""
     try:
-        logger.info(f"Received preview request for chatbot ID: {preview_data.chatbotId}")
-        logger.info(f"Preview settings: {preview_data.settings}")
-        logger.info(f"Preview message: '{preview_data.message}'")
-        logger.info(f"Documents provided: {preview_data.documents}")
+        if logger.isEnabledFor(logging.DEBUG) and random.random() < VERBOSE_LOG_SAMPLE_RATE:
+            logger.debug("preview_payload", extra={
+                "chatbot_id": preview_data.chatbotId,
+                "settings": preview_data.settings.model_dump(),
+                "documents": preview_data.documents
+            })
         
         # Directly call query_engine.query
         response_text, sources, _, rag_status = await query_engine.query(
@@ -498,7 +627,13 @@ async def preview_chatbot(
             model=preview_data.settings.model
         )
         
-        logger.info(f"Preview query complete. Response: {response_text[:100]}..., Sources: {len(sources)}, RAG Status: {rag_status}")
+        logger.info("preview_chat", extra={
+            "chatbot_id": preview_data.chatbotId,
+            "msg_len": len(preview_data.message),
+            "response_len": len(response_text),
+            "sources": len(sources),
+            "rag_status": rag_status
+        })
         
         return {
             "response": response_text,
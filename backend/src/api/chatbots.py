@@ -1,19 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Body
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Query
+from fastapi.responses import StreamingResponse
+from typing import List, Optional, Dict, Any
 import uuid
+import asyncio
 from datetime import datetime
+from itertools import chain
 import logging
 import traceback
+import orjson
 from fastapi import UploadFile, File, Form
 from pydantic import BaseModel
+from firebase_admin.firestore import ArrayUnion, ArrayRemove
 
-from ..db.firebase import firestore_db, firebase_auth
+from ..db.firebase import firestore_db
 from ..models.chatbot import ChatbotCreate, ChatbotResponse, ChatbotUpdate, ChatbotDocumentAssign, ChatbotSettings, ChatMessage, PreviewRequest, PreviewResponse
 from ..services.llm import LLMService
 from ..services.query_engine import QueryEngine
 from ..core.auth import get_current_user_id
 from ..services.auth import get_current_user, User
 from ..utils.logging import get_logger
+from ..utils.cache import AsyncTTLCache
 from ..core.dependencies import get_chatbot_or_404
 
 # Configure logger
@@ -25,25 +31,91 @@ router = APIRouter()
 llm_service = LLMService()
 query_engine = QueryEngine()
 
-# Get current user ID from token
-async def get_current_user_id(token: str = Depends(firebase_auth.oauth2_scheme)):
-    token_data = await firebase_auth.verify_token(token)
-    # Extract uid from token data (which is now a dictionary)
-    if isinstance(token_data, dict):
-        return token_data.get('uid')
-    return token_data
+# Public widget configs are fetched on every embedding page load
+_widget_config_cache = AsyncTTLCache(maxsize=10_000, ttl=60)
+
+# Widget appearance fields: (response key, chatbot appearance key, default)
+_WIDGET_APPEARANCE_FIELDS = (
+    ("position", "widgetPosition", "bottom-right"),
+    ("primaryColor", "primaryColor", "#6366f1"),
+    ("secondaryColor", "secondaryColor", "#4f46e5"),
+    ("showBranding", "showBranding", True),
+)
+_DEFAULT_CHAT_TITLE = "Chat Assistant"
+_DEFAULT_INITIAL_MESSAGE = "Hi! How can I help you today?"
+
+async def _get_owned_chatbot(chatbot_id: str, user_id: str, action: str = "access") -> Dict[str, Any]:
+    """Get a chatbot, checking that the user owns it
+
+    Args:
+        chatbot_id: Chatbot ID
+        user_id: ID of the requesting user
+        action: Verb used in the 403 message
+
+    Returns:
+        Chatbot data
+
+    Raises:
+        HTTPException: 404 if the chatbot doesn't exist, 403 if it belongs to someone else
+    """
+    chatbot = await firestore_db.get_chatbot(chatbot_id)
+    
+    if not chatbot:
+        logger.warning(f"Chatbot not found: {chatbot_id}")
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Chatbot not found"
+        )
+    
+    chatbot_owner = chatbot.get("ownerId")
+    if chatbot_owner != user_id:
+        logger.warning(f"Unauthorized {action} attempt: User {user_id} on chatbot {chatbot_id} owned by {chatbot_owner}")
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Not authorized to {action} this chatbot"
+        )
+    
+    return chatbot
 
 @router.post("/preview", response_model=PreviewResponse)
 async def preview_chatbot(
     preview_data: PreviewRequest,
+    stream: bool = Query(False),
     user_id: Optional[str] = Depends(get_current_user_id)
 ):
-    """Preview chatbot response"""
+    """Preview chatbot response
+    
+    With `stream=true` the response is sent as newline-delimited JSON while
+    it is generated: one {"token"} object per chunk, then a final object
+    carrying the full response, sources and rag_status.
+    """
     try:
-        logger.info(f"Received preview request for chatbot ID: {preview_data.chatbotId}")
-        logger.info(f"Preview settings: {preview_data.settings}")
-        logger.info(f"Preview message: '{preview_data.message}'")
-        logger.info(f"Documents provided: {preview_data.documents}")
+        logger.debug("Received preview request for chatbot ID: %s", preview_data.chatbotId)
+        logger.debug("Preview settings: %s", preview_data.settings)
+        logger.debug("Preview message: '%s'", preview_data.message)
+        logger.debug("Documents provided: %s", preview_data.documents)
+        
+        if stream:
+            document_ids = preview_data.documents
+            if preview_data.chatbotId and not document_ids:
+                # Fall back to the chatbot's own documents, as query() does
+                chatbot = await firestore_db.get_chatbot_cached(preview_data.chatbotId)
+                if not chatbot:
+                    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chatbot not found")
+                document_ids = chatbot.get("documents", [])
+            
+            async def ndjson_stream():
+                async for event in query_engine.stream_query(
+                    query=preview_data.message,
+                    document_ids=document_ids,
+                    temperature=preview_data.settings.temperature,
+                    instructions=preview_data.settings.instructions,
+                    max_tokens=preview_data.settings.maxTokens,
+                    model=preview_data.settings.model
+                ):
+                    yield orjson.dumps(event) + b"\n"
+            
+            return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
         
         # Directly call query_engine.query
         response_text, sources, tokens, rag_status = await query_engine.query(
@@ -56,7 +128,7 @@ async def preview_chatbot(
             model=preview_data.settings.model
         )
         
-        logger.info(f"Preview query complete. Response: {response_text[:100]}..., Sources: {len(sources)}, RAG Status: {rag_status}")
+        logger.debug("Preview query complete. Response: %s..., Sources: %s, RAG Status: %s", response_text[:100], len(sources), rag_status)
         
         return {
             "response": response_text,
@@ -64,6 +136,8 @@ async def preview_chatbot(
             "rag_status": rag_status
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in preview endpoint: {str(e)}")
         logger.error(f"Preview error traceback: {traceback.format_exc()}")
@@ -81,43 +155,32 @@ async def create_chatbot(
     try:
         # Get the user's actual ID from the token
         user_uid = user_id.get('uid') if isinstance(user_id, dict) else user_id
-        logger.info(f"Creating new chatbot for user: {user_uid}")
-        logger.info(f"Chatbot data: name='{chatbot.name}', description='{chatbot.description}'")
-        logger.info(f"Chatbot settings: {chatbot.settings}")
-        logger.info(f"Chatbot documents: {chatbot.documents}")
+        logger.debug("Creating new chatbot for user: %s", user_uid)
+        logger.debug("Chatbot data: name='%s', description='%s'", chatbot.name, chatbot.description)
+        logger.debug("Chatbot settings: %s", chatbot.settings)
+        logger.debug("Chatbot documents: %s", chatbot.documents)
         
         # Generate unique ID for chatbot
         chatbot_id = str(uuid.uuid4())
-        logger.info(f"Generated chatbot ID: {chatbot_id}")
+        logger.debug("Generated chatbot ID: %s", chatbot_id)
         
-        # Create chatbot data
-        current_time = datetime.now()
+        # Create chatbot data; createdAt/updatedAt are stamped by Firestore
         chatbot_data = {
             "id": chatbot_id,
             "name": chatbot.name,
             "description": chatbot.description,
-            "settings": chatbot.settings.dict(),
+            "settings": chatbot.settings.model_dump(),
             "ownerId": user_uid,
-            "documents": chatbot.documents,
-            "createdAt": current_time,
-            "updatedAt": current_time
+            "documents": chatbot.documents
         }
         
-        # Save to Firestore using the FirestoreDB method
+        # Save to Firestore using the FirestoreDB method. The write is
+        # committed when this returns, so there is no need to read it back.
         await firestore_db.create_chatbot(chatbot_data)
-        logger.info(f"Successfully created chatbot with ID: {chatbot_id}")
-        
-        # Verify the chatbot was created by retrieving it
-        created_chatbot = await firestore_db.get_chatbot(chatbot_id)
-        if not created_chatbot:
-            logger.error(f"Chatbot was not found after creation: {chatbot_id}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Chatbot created but could not be retrieved. Please try again."
-            )
+        logger.debug("Successfully created chatbot with ID: %s", chatbot_id)
         
-        logger.info(f"Verified chatbot was successfully persisted: {chatbot_id}")
-        return ChatbotResponse(**created_chatbot)
+        now = datetime.now()
+        return ChatbotResponse(**chatbot_data, createdAt=now, updatedAt=now)
     except Exception as e:
         logger.error(f"Failed to create chatbot: {str(e)}")
         import traceback
@@ -150,33 +213,15 @@ async def get_chatbot(
 ):
     """Get chatbot details"""
     try:
-        logger.info(f"Fetching chatbot with ID: {chatbot_id}")
+        logger.debug("Fetching chatbot with ID: %s", chatbot_id)
         
         # Get the user's actual ID from the token
         user_uid = user_id.get('uid') if isinstance(user_id, dict) else user_id
-        logger.info(f"User ID: {user_uid}")
+        logger.debug("User ID: %s", user_uid)
         
-        chatbot = await firestore_db.get_chatbot(chatbot_id)
+        chatbot = await _get_owned_chatbot(chatbot_id, user_uid)
         
-        if not chatbot:
-            logger.warning(f"Chatbot not found: {chatbot_id}")
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Chatbot not found"
-            )
-        
-        # Check if user owns the chatbot
-        chatbot_owner = chatbot.get("ownerId")
-        logger.info(f"Chatbot owner: {chatbot_owner}, requesting user: {user_uid}")
-        
-        if chatbot_owner != user_uid:
-            logger.warning(f"Unauthorized access attempt: User {user_uid} tried to access chatbot {chatbot_id} owned by {chatbot_owner}")
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Not authorized to access this chatbot"
-            )
-        
-        logger.info(f"Successfully retrieved chatbot {chatbot_id}")
+        logger.debug("Successfully retrieved chatbot %s", chatbot_id)
         return ChatbotResponse(**chatbot)
     except HTTPException:
         raise
@@ -200,44 +245,25 @@ async def update_chatbot(
         # Extract uid from user_id (which could be a dict or string)
         user_uid = user_id.get('uid') if isinstance(user_id, dict) else user_id
         
-        logger.info(f"Attempting to update chatbot {chatbot_id} by user {user_uid}")
-        logger.info(f"Update data: {chatbot_update.dict()}")
-        
-        # Get the chatbot
-        chatbot = await firestore_db.get_chatbot(chatbot_id)
+        # Dump only the fields the client actually sent, once
+        payload = chatbot_update.model_dump(exclude_unset=True, exclude_none=True)
         
-        if not chatbot:
-            logger.error(f"Chatbot {chatbot_id} not found")
-            raise HTTPException(status_code=404, detail="Chatbot not found")
+        logger.debug("Attempting to update chatbot %s by user %s", chatbot_id, user_uid)
+        logger.debug("Update data: %s", payload)
         
-        chatbot_owner = chatbot.get("ownerId")
-        
-        # Check if the current user is the owner
-        if chatbot_owner != user_uid:
-            logger.error(f"Unauthorized update attempt: User {user_uid} is not the owner of chatbot {chatbot_id} (owner is {chatbot_owner})")
-            raise HTTPException(status_code=403, detail="Not authorized to update this chatbot")
+        # Get the chatbot, checking the current user is the owner
+        chatbot = await _get_owned_chatbot(chatbot_id, user_uid, "update")
         
         # Prepare update data
-        update_data = {}
-        
-        if chatbot_update.name is not None:
-            update_data["name"] = chatbot_update.name
+        update_data = {k: payload[k] for k in ("name", "description", "settings") if k in payload}
         
-        if chatbot_update.description is not None:
-            update_data["description"] = chatbot_update.description
-        
-        if chatbot_update.settings is not None:
-            update_data["settings"] = chatbot_update.settings.dict(exclude_unset=True)
-        
-        # Update timestamp
-        update_data["updatedAt"] = datetime.now().isoformat()
-        
-        # Update document in Firestore
+        # Update document in Firestore; updatedAt is stamped server-side
         await firestore_db.update_chatbot(chatbot_id, update_data)
-        logger.info(f"Chatbot {chatbot_id} updated successfully")
+        _widget_config_cache.invalidate(chatbot_id)
+        logger.debug("Chatbot %s updated successfully", chatbot_id)
         
-        # Get updated chatbot
-        updated_chatbot = await firestore_db.get_chatbot(chatbot_id)
+        # Build the updated chatbot locally instead of re-reading it
+        updated_chatbot = {**chatbot, **update_data, "updatedAt": datetime.now()}
         return ChatbotResponse(**updated_chatbot)
     
     except HTTPException as e:
@@ -253,20 +279,7 @@ async def delete_chatbot(chatbot_id: str, user_id: str = Depends(get_current_use
     """Delete a chatbot"""
     try:
         # Get chatbot to check ownership
-        chatbot = await firestore_db.get_chatbot(chatbot_id)
-        
-        if not chatbot:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Chatbot not found"
-            )
-        
-        # Check if user owns the chatbot
-        if chatbot.get("ownerId") != user_id:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Not authorized to delete this chatbot"
-            )
+        await _get_owned_chatbot(chatbot_id, user_id, "delete")
             
         logger.info(f"Starting deletion process for chatbot {chatbot_id}")
         
@@ -274,9 +287,26 @@ async def delete_chatbot(chatbot_id: str, user_id: str = Depends(get_current_use
         try:
             logger.info(f"Deleting chat sessions for chatbot {chatbot_id}")
             sessions = await firestore_db.list_chat_sessions_by_chatbot(chatbot_id)
-            for session in sessions:
-                await firestore_db.delete_chat_session(session["id"])
-            logger.info(f"Deleted {len(sessions)} chat sessions")
+            session_ids = [session["id"] for session in sessions]
+            
+            # Purge message subcollections concurrently, then drop the
+            # session documents in batched writes
+            semaphore = asyncio.Semaphore(16)
+            
+            async def purge_messages(session_id: str):
+                async with semaphore:
+                    await firestore_db.delete_messages_subcollection(session_id)
+            
+            results = await asyncio.gather(
+                *(purge_messages(session_id) for session_id in session_ids),
+                return_exceptions=True
+            )
+            for session_id, result in zip(session_ids, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Error deleting messages for session {session_id}: {str(result)}")
+            
+            await firestore_db.delete_chat_sessions_bulk(session_ids)
+            logger.info(f"Deleted {len(session_ids)} chat sessions")
         except Exception as e:
             logger.error(f"Error deleting chat sessions: {str(e)}")
             # Continue with deletion even if session cleanup fails
@@ -287,6 +317,7 @@ async def delete_chatbot(chatbot_id: str, user_id: str = Depends(get_current_use
         # Delete chatbot from Firestore
         logger.info(f"Deleting chatbot metadata from Firestore")
         await firestore_db.delete_chatbot(chatbot_id)
+        _widget_config_cache.invalidate(chatbot_id)
         
         logger.info(f"Chatbot {chatbot_id} deleted successfully")
         return None
@@ -304,25 +335,17 @@ async def delete_chatbot(chatbot_id: str, user_id: str = Depends(get_current_use
 async def assign_documents(chatbot_id: str, document_data: ChatbotDocumentAssign, user_id: str = Depends(get_current_user_id)):
     """Assign documents to a chatbot"""
     try:
-        # Get chatbot to check ownership
-        chatbot = await firestore_db.get_chatbot(chatbot_id)
-        
-        if not chatbot:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Chatbot not found"
-            )
-        
-        # Check if user owns the chatbot
-        if chatbot.get("ownerId") != user_id:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Not authorized to update this chatbot"
-            )
+        # Check chatbot ownership and fetch the documents in one batched
+        # read, concurrently since neither depends on the other
+        chatbot, documents = await asyncio.gather(
+            _get_owned_chatbot(chatbot_id, user_id, "update"),
+            firestore_db.get_documents_bulk(document_data.documentIds)
+        )
         
         # Verify all documents exist and are owned by the user
+        
         for doc_id in document_data.documentIds:
-            document = await firestore_db.get_document(doc_id)
+            document = documents.get(doc_id)
             if not document:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
@@ -334,20 +357,17 @@ async def assign_documents(chatbot_id: str, document_data: ChatbotDocumentAssign
                     detail=f"Not authorized to use document {doc_id}"
                 )
         
-        # Update chatbot documents
-        current_docs = chatbot.get("documents", [])
-        new_docs = list(set(current_docs + document_data.documentIds))
-        
+        # Append the documents atomically; ArrayUnion skips ones already assigned
         update_data = {
-            "documents": new_docs,
-            "updatedAt": datetime.now()
+            "documents": ArrayUnion(document_data.documentIds)
         }
         
         # Update chatbot in Firestore
         await firestore_db.update_chatbot(chatbot_id, update_data)
         
-        # Get updated chatbot
-        updated_chatbot = await firestore_db.get_chatbot(chatbot_id)
+        # Build the updated chatbot locally instead of re-reading it
+        new_docs = list(dict.fromkeys(chain(chatbot.get("documents", []), document_data.documentIds)))
+        updated_chatbot = {**chatbot, "documents": new_docs, "updatedAt": datetime.now()}
         
         return ChatbotResponse(**updated_chatbot)
     except HTTPException:
@@ -363,20 +383,7 @@ async def remove_document(chatbot_id: str, document_id: str, user_id: str = Depe
     """Remove a document from a chatbot"""
     try:
         # Get chatbot to check ownership
-        chatbot = await firestore_db.get_chatbot(chatbot_id)
-        
-        if not chatbot:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Chatbot not found"
-            )
-        
-        # Check if user owns the chatbot
-        if chatbot.get("ownerId") != user_id:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Not authorized to update this chatbot"
-            )
+        chatbot = await _get_owned_chatbot(chatbot_id, user_id, "update")
         
         # Update chatbot documents
         current_docs = chatbot.get("documents", [])
@@ -386,18 +393,17 @@ async def remove_document(chatbot_id: str, document_id: str, user_id: str = Depe
                 detail=f"Document {document_id} not assigned to this chatbot"
             )
         
-        new_docs = [doc for doc in current_docs if doc != document_id]
-        
+        # Remove the document atomically without rewriting the whole list
         update_data = {
-            "documents": new_docs,
-            "updatedAt": datetime.now()
+            "documents": ArrayRemove([document_id])
         }
         
         # Update chatbot in Firestore
         await firestore_db.update_chatbot(chatbot_id, update_data)
         
-        # Get updated chatbot
-        updated_chatbot = await firestore_db.get_chatbot(chatbot_id)
+        # Build the updated chatbot locally instead of re-reading it
+        new_docs = [doc for doc in current_docs if doc != document_id]
+        updated_chatbot = {**chatbot, "documents": new_docs, "updatedAt": datetime.now()}
         
         return ChatbotResponse(**updated_chatbot)
     except HTTPException:
@@ -413,59 +419,34 @@ async def get_widget_config(chatbot_id: str):
     """
     Get widget configuration for a chatbot (no authentication required)
     """
-    logger.info(f"Widget config requested for chatbot: {chatbot_id}")
+    logger.debug("Widget config requested for chatbot: %s", chatbot_id)
     
     try:
-        # Get the chatbot from database
-        chatbot = await get_chatbot_or_404(chatbot_id)
-        
-        # Extract widget-specific settings
-        settings = chatbot.get("settings", {})
-        appearance = settings.get("appearance", {})
-        
-        # Return widget configuration with proper structure
-        return {
-            "settings": {
-                "appearance": {
-                    "position": appearance.get("widgetPosition", "bottom-right"),
-                    "primaryColor": appearance.get("primaryColor", "#6366f1"),
-                    "secondaryColor": appearance.get("secondaryColor", "#4f46e5"),
-                    "chatTitle": chatbot.get("name", "Chat Assistant"),
-                    "showBranding": appearance.get("showBranding", True),
-                    "initialMessage": settings.get("welcomeMessage", "Hi! How can I help you today?")
-                }
-            },
-            "name": chatbot.get("name", "Chat Assistant"),
-            "description": chatbot.get("description", "")
-        }
-    
+        return await _widget_config_cache.get_or_fetch(chatbot_id, lambda: _build_widget_config(chatbot_id))
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error getting widget config: {str(e)}")
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Error getting widget configuration: {str(e)}")
 
-# Utility function to get a chatbot or raise 404
-async def get_chatbot_or_404(chatbot_id: str):
-    """Get a chatbot or raise a 404 error if not found"""
-    from ..db.firebase import FirestoreDB
+async def _build_widget_config(chatbot_id: str) -> Dict[str, Any]:
+    """Build the public widget configuration for a chatbot"""
+    # Get the chatbot from database
+    chatbot = await get_chatbot_or_404(chatbot_id)
     
-    try:
-        # Get database reference
-        firestore_db = FirestoreDB()
-        
-        # Get the chatbot from Firebase
-        chatbot_ref = firestore_db.db.collection("chatbots").document(chatbot_id)
-        chatbot_doc = chatbot_ref.get()
-        
-        if not chatbot_doc.exists:
-            logger.warning(f"Chatbot not found: {chatbot_id}")
-            raise HTTPException(status_code=404, detail="Chatbot not found")
-            
-        # Return chatbot data
-        return chatbot_doc.to_dict()
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error getting chatbot: {str(e)}")
-        logger.error(traceback.format_exc())
-        raise HTTPException(status_code=500, detail=f"Error retrieving chatbot: {str(e)}")
\ No newline at end of file
+    # Extract widget-specific settings
+    settings = chatbot.get("settings", {})
+    appearance = settings.get("appearance", {})
+    
+    name = chatbot.get("name", _DEFAULT_CHAT_TITLE)
+    widget_appearance = {key: appearance.get(source, default) for key, source, default in _WIDGET_APPEARANCE_FIELDS}
+    widget_appearance["chatTitle"] = name
+    widget_appearance["initialMessage"] = settings.get("welcomeMessage", _DEFAULT_INITIAL_MESSAGE)
+    
+    # Return widget configuration with proper structure
+    return {
+        "settings": {"appearance": widget_appearance},
+        "name": name,
+        "description": chatbot.get("description", "")
+    }
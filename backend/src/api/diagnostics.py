@@ -1,11 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from typing import Dict, Any, List
 import logging
+import asyncio
 from datetime import datetime
 import traceback
 
 from ..db.vector_store import get_vector_db
-from ..db.firebase import FirestoreDB
+from ..db.firebase import FirestoreDB, get_firestore_db
 from ..services.document_processor import DocumentProcessor
 from ..services.embedding import EmbeddingService
 from ..core.auth import get_current_user_id
@@ -14,14 +15,14 @@ from ..services.auth import get_current_user
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
-firestore_db = FirestoreDB()
+firestore_db = get_firestore_db()
 
 @router.get("/health")
 async def health_check():
     """Basic health check endpoint"""
     return {
         "status": "ok",
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": datetime.now(),
         "version": "1.0.0"
     }
 
@@ -44,12 +45,9 @@ async def vector_db_status():
         )
 
 @router.get("/document-stats", dependencies=[Depends(get_current_user_id)])
-async def document_stats():
+async def document_stats(firestore_db: FirestoreDB = Depends(get_firestore_db)):
     """Get document statistics"""
     try:
-        # Initialize Firestore
-        firestore_db = FirestoreDB()
-        
         # Get document counts by status
         result = await firestore_db.get_document_stats()
         
@@ -94,31 +92,34 @@ async def test_embedding(text: str):
         )
 
 @router.get("/system-status", dependencies=[Depends(get_current_user_id)])
-async def system_status():
+async def system_status(firestore_db: FirestoreDB = Depends(get_firestore_db)):
     """Get overall system status"""
     try:
         # Initialize components
         vector_db = get_vector_db()
-        firestore_db = FirestoreDB()
+        embedding_service = EmbeddingService()
         
-        # Check vector DB
-        vector_status = vector_db.check_connection()
+        # Probe vector DB, document store and embedding service concurrently
+        vector_status, document_stats, embedding_result = await asyncio.gather(
+            asyncio.to_thread(vector_db.check_connection),
+            firestore_db.get_document_stats(),
+            embedding_service.get_embedding("This is a test embedding for system status check."),
+            return_exceptions=True
+        )
         
-        # Get document stats
-        document_stats = await firestore_db.get_document_stats()
+        # Vector DB and document store failures still fail the whole check
+        if isinstance(vector_status, Exception):
+            raise vector_status
+        if isinstance(document_stats, Exception):
+            raise document_stats
         
-        # Check embedding service
-        embedding_service = EmbeddingService()
         embedding_status = "ok"
-        try:
-            # Generate a test embedding
-            await embedding_service.get_embedding("This is a test embedding for system status check.")
-        except Exception as e:
-            embedding_status = f"error: {str(e)}"
+        if isinstance(embedding_result, Exception):
+            embedding_status = f"error: {str(embedding_result)}"
         
         return {
             "status": "ok",
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": datetime.now(),
             "services": {
                 "vector_db": vector_status.get("status"),
                 "document_store": "ok",  # Firestore is likely up if we got document_stats
@@ -131,7 +132,7 @@ async def system_status():
         logger.error(f"Error checking system status: {str(e)}")
         return {
             "status": "error",
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": datetime.now(),
             "error": str(e)
         }
 
@@ -144,20 +145,23 @@ async def get_overview_stats(user_id: str = Depends(get_current_user)) -> Dict[s
         # Extract just the user ID string
         user_id_str = user_id.id
         
-        # Get total chatbots
-        chatbots = await firestore_db.list_chatbots(user_id_str)
+        # Get chatbots, conversations (chat sessions) and datasources
+        # (documents) concurrently; one failing query doesn't cancel the others
+        results = await asyncio.gather(
+            firestore_db.list_chatbots(user_id_str),
+            firestore_db.list_chat_sessions(user_id_str),
+            firestore_db.list_documents(user_id_str),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        chatbots, chat_sessions, documents = results
+        
         total_chatbots = len(chatbots)
-        logger.debug(f"Found {total_chatbots} chatbots")
-
-        # Get total conversations (chat sessions)
-        chat_sessions = await firestore_db.list_chat_sessions(user_id_str)
         total_conversations = len(chat_sessions)
-        logger.debug(f"Found {total_conversations} conversations")
-
-        # Get total datasources (documents)
-        documents = await firestore_db.list_documents(user_id_str)
         total_datasources = len(documents)
-        logger.debug(f"Found {total_datasources} datasources")
+        logger.debug(f"Found {total_chatbots} chatbots, {total_conversations} conversations, {total_datasources} datasources")
 
         stats = {
             "total_chatbots": total_chatbots,
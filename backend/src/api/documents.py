@@ -1,26 +1,33 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Body
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Body, Query, Response
 from typing import List, Optional
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
 import logging
 import asyncio
+import os
 
-from ..db.firebase import FirestoreDB, FirebaseStorage
+from ..db.firebase import get_firestore_db, get_firebase_storage
+from ..core.config import settings
 from ..models.document import DocumentCreate, DocumentResponse, DocumentUpdate, DocumentUpload, Document
 from ..services.document_processor import DocumentProcessor
 from ..core.auth import get_current_user_id
 from ..services.auth import get_current_user, User
 from ..services.website_scraper import website_scraper
-from ..tasks.document_tasks import process_document
+from ..utils.file_utils import content_matches_extension
+from ..tasks.document_tasks import task_queue, reindex_queue
 
 router = APIRouter()
-firestore_db = FirestoreDB()
-firebase_storage = FirebaseStorage()
+firestore_db = get_firestore_db()
+firebase_storage = get_firebase_storage()
 document_processor = DocumentProcessor()
 
 logger = logging.getLogger(__name__)
 
-@router.post("/upload")
+# Bounds concurrent storage uploads so a burst of uploads queues up here
+# instead of exhausting memory and connections
+_upload_semaphore = asyncio.Semaphore(int(os.getenv("MAX_CONCURRENT_UPLOADS", "16")))
+
+@router.post("/upload", status_code=status.HTTP_202_ACCEPTED)
 async def upload_document(
     file: UploadFile = File(...),
     name: str = Form(...),
@@ -38,16 +45,26 @@ async def upload_document(
                 detail=f"File type not supported. Allowed types: {', '.join(allowed_types)}"
             )
         
+        # Reject files whose content doesn't match the extension before
+        # spending a storage upload and a processing job on them
+        if not await content_matches_extension(file):
+            raise HTTPException(
+                status_code=400,
+                detail="File content does not match its file type"
+            )
+        
         # Create document ID first
-        document_id = str(uuid.uuid4())
+        document_id = uuid.uuid4().hex
         logger.info(f"Generated document ID: {document_id}")
 
         # Upload file to storage (pass document_id and user_id)
-        file_size = await firebase_storage.upload_file(file, document_id, user_id)
+        async with _upload_semaphore:
+            file_size = await firebase_storage.upload_file(file, document_id, user_id)
         storage_path = f"documents/{user_id}/{document_id}/{file.filename}" # Construct storage path
         logger.info(f"File uploaded successfully to storage: {storage_path}")
         
         # Create document data in Firestore
+        now = datetime.now(timezone.utc)
         document_data = {
             "id": document_id, # Add ID to the data
             "name": name, # Use name from form
@@ -55,11 +72,11 @@ async def upload_document(
             "ownerId": user_id, # Add owner ID
             "fileType": file.filename.split('.')[-1] if '.' in file.filename else 'unknown',
             "fileSize": file_size,
-            "uploadedAt": datetime.utcnow().isoformat(),
+            "uploadedAt": now,
             "storageUri": storage_path,
             "processingStatus": "pending",
-            "createdAt": datetime.utcnow().isoformat(),
-            "updatedAt": datetime.utcnow().isoformat(),
+            "createdAt": now,
+            "updatedAt": now,
             "chunkCount": 0,
             "vectorIds": [],
             "error": None
@@ -69,31 +86,21 @@ async def upload_document(
         await firestore_db.create_document(document_data) # Assuming create_document handles setting with ID
         logger.info(f"Document metadata created in Firestore for ID: {document_id}")
         
-        # Queue document processing task to the correct queue
-        logger.info(f"Starting synchronous document processing for document ID: {document_id}")
-        try:
-            await process_document(document_id)
-            logger.info(f"Synchronous processing completed for document ID: {document_id}")
-        except Exception as process_error:
-            logger.error(f"Synchronous processing failed for document ID {document_id}: {process_error}", exc_info=True)
-            # Optionally re-raise or handle the error appropriately for the API response
-            # For now, we log it and let the function continue to return 'pending', 
-            # but the status in Firestore would have been set to 'failed' by process_document
-            pass 
-        logger.info(f"Document processing initiated synchronously for document ID: {document_id}")
+        # Queue document processing; workers update the status in Firestore
+        await task_queue.enqueue(document_id)
         
-        # Return the document ID and status
-        # The status is initially 'pending', but will be updated by process_document.
-        # Consider if the API should wait and return the final status, or return immediately.
-        # For now, returning 'pending' as before.
+        # Return the document ID and status. Clients poll
+        # GET /documents/{document_id}/status for progress.
         return {
             "documentId": document_id,
-            "status": "pending", # Or potentially query the status after await?
-            "message": "Document upload successful. Processing initiated.", # MODIFIED
+            "status": "pending",
+            "message": "Document upload successful. Processing initiated.",
             "name": name, # Return name for consistency
             "id": document_id # Return id as well
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in document upload for user {user_id}: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -101,13 +108,31 @@ async def upload_document(
             detail=f"Error uploading document: {str(e)}"
         )
 
+# Fields rendered by DocumentResponse; chunk vector IDs and inline content
+# are left out of list pages
+DOCUMENT_LIST_FIELDS = [
+    "id", "name", "description", "ownerId", "fileType", "fileSize", "uploadedAt",
+    "processingStatus", "chunkCount", "metadata", "error"
+]
+
 @router.get("", response_model=List[DocumentResponse])
-async def list_documents(user_id: str = Depends(get_current_user_id)):
-    """List all documents for the current user"""
+async def list_documents(
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    user_id: str = Depends(get_current_user_id)
+):
+    """List a page of documents for the current user
+    
+    The ID to pass as `cursor` for the next page is returned in the
+    X-Next-Cursor header when more documents may follow.
+    """
     try:
         logger.info(f"Listing documents for user: {user_id}")
-        documents = await firestore_db.list_documents(user_id)
+        documents = await firestore_db.list_documents(user_id, limit=limit, cursor=cursor, fields=DOCUMENT_LIST_FIELDS)
         logger.info(f"Found {len(documents)} documents")
+        if len(documents) == limit:
+            response.headers["X-Next-Cursor"] = documents[-1]["id"]
         return documents
     except Exception as e:
         logger.error(f"Failed to list documents for user {user_id}: {str(e)}")
@@ -120,28 +145,49 @@ async def list_documents(user_id: str = Depends(get_current_user_id)):
 async def get_document(document_id: str, user_id: str = Depends(get_current_user_id)):
     """Get document details"""
     try:
-        document = await firestore_db.get_document(document_id)
+        document = await firestore_db.get_owned_document(document_id, user_id)
         
+        # Documents owned by someone else are reported as not found
         if not document:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Document not found"
             )
         
-        # Check if user owns the document
-        if document.get("ownerId") != user_id:
+        return document
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Failed to get document: {str(e)}"
+        )
+
+@router.get("/{document_id}/status")
+async def get_document_status(document_id: str, user_id: str = Depends(get_current_user_id)):
+    """Get the processing status of a document"""
+    try:
+        document = await firestore_db.get_owned_document(document_id, user_id)
+        
+        # Documents owned by someone else are reported as not found
+        if not document:
             raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Not authorized to access this document"
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Document not found"
             )
         
-        return document
+        return {
+            "id": document_id,
+            "status": document.get("processingStatus", "pending"),
+            "chunkCount": document.get("chunkCount", 0),
+            "error": document.get("error")
+        }
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Failed to get document: {str(e)}"
+            detail=f"Failed to get document status: {str(e)}"
         )
 
 @router.delete("/{document_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -150,58 +196,57 @@ async def delete_document(document_id: str, user_id: str = Depends(get_current_u
     try:
         logger.info(f"Starting deletion process for document {document_id}")
         
+        # Get the user's actual ID from the token
+        user_uid = user_id.get('uid') if isinstance(user_id, dict) else user_id
+        
         # Get document to check ownership
-        document = await firestore_db.get_document(document_id)
+        document = await firestore_db.get_owned_document(document_id, user_uid)
         
+        # Documents owned by someone else are reported as not found
         if not document:
             logger.warning(f"Document {document_id} not found")
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Document not found"
             )
-        
-        # Get the user's actual ID from the token
-        user_uid = user_id.get('uid') if isinstance(user_id, dict) else user_id
-        
-        # Check if user owns the document
-        if document.get("ownerId") != user_uid:
-            logger.warning(f"User {user_uid} not authorized to delete document {document_id}")
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Not authorized to delete this document"
-            )
             
         try:
-            # First, remove document from any chatbots that reference it
-            chatbots = await firestore_db.list_chatbots(user_uid)
-            for chatbot in chatbots:
-                if document_id in chatbot.get("documents", []):
-                    logger.info(f"Removing document {document_id} from chatbot {chatbot['id']}")
-                    current_docs = chatbot.get("documents", [])
-                    new_docs = [doc for doc in current_docs if doc != document_id]
-                    await firestore_db.update_chatbot(chatbot["id"], {
-                        "documents": new_docs,
-                        "updatedAt": datetime.now()
-                    })
+            async def delete_metadata():
+                # Unlink the document from its chatbots and delete the
+                # metadata from Firestore in batched writes
+                chatbot_ids = await firestore_db.list_chatbot_ids_referencing(user_uid, document_id)
+                logger.info(f"Deleting document metadata from Firestore and unlinking it from {len(chatbot_ids)} chatbots")
+                await firestore_db.delete_document_and_unlink(document_id, chatbot_ids)
             
-            # Delete vector embeddings if they exist
-            if document.get("vectorIds"):
-                logger.info(f"Deleting vector embeddings for document {document_id}")
-                await document_processor.delete_document(document_id)
+            async def delete_vectors():
+                # Delete vector embeddings if they exist. This goes straight to
+                # the vector store: DocumentProcessor.delete_document re-reads
+                # the metadata being deleted alongside and would skip the
+                # embeddings, or delete the file and metadata a second time.
+                if document.get("vectorIds"):
+                    logger.info(f"Deleting vector embeddings for document {document_id}")
+                    await document_processor.vector_db.delete_by_document_id(document_id)
             
-            # Delete file from Firebase Storage if it exists
-            storage_uri = document.get("storageUri")
-            if storage_uri:
-                logger.info(f"Deleting file from storage: {storage_uri}")
-                try:
+            async def delete_file():
+                # Delete file from Firebase Storage if it exists
+                storage_uri = document.get("storageUri")
+                if storage_uri:
+                    logger.info(f"Deleting file from storage: {storage_uri}")
                     await firebase_storage.delete_file(storage_uri)
-                except Exception as e:
-                    logger.warning(f"Failed to delete file from storage: {str(e)}")
-                    # Continue with deletion even if storage deletion fails
             
-            # Finally, delete document from Firestore
-            logger.info(f"Deleting document metadata from Firestore")
-            await firestore_db.delete_document(document_id)
+            # The three stores are independent, so clean them up concurrently
+            metadata_result, vectors_result, file_result = await asyncio.gather(
+                delete_metadata(), delete_vectors(), delete_file(),
+                return_exceptions=True
+            )
+            
+            if isinstance(vectors_result, Exception):
+                logger.error(f"Failed to delete vector embeddings for document {document_id}: {str(vectors_result)}")
+            if isinstance(file_result, Exception):
+                # Continue with deletion even if storage deletion fails
+                logger.warning(f"Failed to delete file from storage: {str(file_result)}")
+            if isinstance(metadata_result, Exception):
+                raise metadata_result
             
             logger.info(f"Document {document_id} deleted successfully")
             return None
@@ -222,40 +267,45 @@ async def delete_document(document_id: str, user_id: str = Depends(get_current_u
             detail=f"Failed to delete document: {str(e)}"
         )
 
-@router.post("/{document_id}/reindex", response_model=DocumentResponse)
+@router.post("/{document_id}/reindex", response_model=DocumentResponse, status_code=status.HTTP_202_ACCEPTED)
 async def reindex_document(document_id: str, user_id: str = Depends(get_current_user_id)):
     """Reindex a document"""
     try:
         # Get document to check ownership
-        document = await firestore_db.get_document(document_id)
+        document = await firestore_db.get_owned_document(document_id, user_id)
         
+        # Documents owned by someone else are reported as not found
         if not document:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Document not found"
             )
         
-        # Check if user owns the document
-        if document.get("ownerId") != user_id:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Not authorized to reindex this document"
-            )
-        
-        # Update document status to processing
-        await firestore_db.update_document(document_id, {
+        # Move the document to processing, unless it is already queued or
+        # being processed. A document stuck in pending or processing (its
+        # job was lost, e.g. in a restart) can be claimed once it times out.
+        reset_data = {
             "processingStatus": "processing",
             "chunkCount": None,
             "vectorIds": None
-        })
-        
-        # Process document immediately
-        await document_processor.process_document_immediately(document_id)
+        }
+        claimed = await firestore_db.claim_document(
+            document_id,
+            ("completed", "failed"),
+            reset_data,
+            stale_statuses=("pending", "processing"),
+            stale_after=settings.DOCUMENT_PROCESSING_TIMEOUT
+        )
+        if not claimed:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Document is already being processed"
+            )
         
-        # Get updated document
-        updated_document = await firestore_db.get_document(document_id)
+        # Queue the reindex; clients poll GET /documents/{document_id}/status
+        await reindex_queue.enqueue(document_id)
         
-        return updated_document
+        return {**document, **reset_data}
     except HTTPException:
         raise
     except Exception as e:
@@ -264,7 +314,7 @@ async def reindex_document(document_id: str, user_id: str = Depends(get_current_
             detail=f"Failed to reindex document: {str(e)}"
         )
 
-@router.post("/url")
+@router.post("/url", status_code=status.HTTP_202_ACCEPTED)
 async def create_document_from_url(
     url: str = Body(...),
     name: Optional[str] = Body(None),
@@ -295,18 +345,24 @@ async def create_document_from_url(
         logger.info(f"Content length: {len(scraped_data['content'])} characters")
             
         # Create document ID first
-        document_id = str(uuid.uuid4())
+        document_id = uuid.uuid4().hex
         logger.info(f"Generated document ID for URL import: {document_id}")
         
+        # Store the scraped text in Storage rather than inline in Firestore,
+        # which caps documents at 1 MiB and bills reads by size
+        storage_path = f"documents/{current_user.id}/{document_id}/content.txt"
+        file_size = await firebase_storage.upload_bytes(scraped_data['content'].encode('utf-8'), storage_path)
+        
         # Prepare document data
+        now = datetime.now(timezone.utc)
         document_data = {
             "id": document_id,
             "name": name or scraped_data['title'] or f"Website - {url[:50]}...", # Ensure name is not empty
             "description": description or scraped_data['description'] or "",
             "ownerId": current_user.id,
-            "content": scraped_data['content'], # Store raw content temporarily
+            "storageUri": storage_path,
             "fileType": "website",
-            "fileSize": len(scraped_data['content'].encode('utf-8')),
+            "fileSize": file_size,
             # MODIFY: Set status to pending
             "processingStatus": "pending", 
             "source_url": url,
@@ -317,27 +373,19 @@ async def create_document_from_url(
                 "title": scraped_data['title'],
                 "description": scraped_data['description']
             },
-            "uploadedAt": datetime.now(),
-            "createdAt": datetime.now(),
-            "updatedAt": datetime.now()
+            "uploadedAt": now,
+            "createdAt": now,
+            "updatedAt": now
         }
         
         # Save initial metadata to database
         await firestore_db.create_document(document_data)
         logger.info(f"Initial document metadata created successfully with ID: {document_id}")
 
-        # ADD: Trigger synchronous processing
-        logger.info(f"Starting synchronous processing for URL document ID: {document_id}")
-        try:
-            await process_document(document_id)
-            logger.info(f"Synchronous URL processing completed for document ID: {document_id}")
-            # Optional: Update status explicitly to 'completed' here if process_document doesn't always do it on success?
-        except Exception as process_error:
-            logger.error(f"Synchronous URL processing failed for document ID {document_id}: {process_error}", exc_info=True)
-            # Status should have been set to 'failed' within process_document
-            pass # Let the API return the initial pending status
+        # Queue processing; workers update the status in Firestore
+        await task_queue.enqueue(document_id)
         
-        # Return initial response - processing happens in the background (now synchronously)
+        # Return initial response - processing happens in the background
         return {
             "id": document_id, # Use the generated ID
             "name": document_data['name'],
@@ -3,6 +3,7 @@ from pydantic import BaseModel
 from typing import Optional
 from ...core.config import settings
 import os
+import asyncio
 import logging
 from dotenv import set_key, find_dotenv
 
@@ -10,6 +11,9 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Resolve the .env path once instead of walking the directory tree per request
+ENV_FILE = find_dotenv() or ".env"
+
 class VectorStoreSettings(BaseModel):
     type: str  # "zilliz" or "qdrant"
     zilliz_uri: Optional[str] = None
@@ -17,6 +21,19 @@ class VectorStoreSettings(BaseModel):
     qdrant_url: Optional[str] = None
     qdrant_api_key: Optional[str] = None
 
+def _persist_settings(settings_data: VectorStoreSettings) -> None:
+    """Write vector store settings to .env and reload them (blocking file I/O)"""
+    set_key(ENV_FILE, "VECTOR_DB_TYPE", settings_data.type)
+    if settings_data.type == "zilliz":
+        set_key(ENV_FILE, "ZILLIZ_URI", settings_data.zilliz_uri)
+        set_key(ENV_FILE, "ZILLIZ_API_KEY", settings_data.zilliz_api_key)
+    else:
+        set_key(ENV_FILE, "QDRANT_URL", settings_data.qdrant_url)
+        set_key(ENV_FILE, "QDRANT_API_KEY", settings_data.qdrant_api_key)
+    
+    # Reload settings to pick up persisted values
+    settings.reload()
+
 @router.get("")
 async def get_vector_store_settings():
     """Get current vector store settings"""
@@ -64,23 +81,15 @@ async def update_vector_store_settings(settings_data: VectorStoreSettings):
             os.environ["QDRANT_URL"] = settings_data.qdrant_url
             os.environ["QDRANT_API_KEY"] = settings_data.qdrant_api_key
         
-        # Persist changes to .env so they survive restarts
-        env_file = find_dotenv() or ".env"
-        set_key(env_file, "VECTOR_DB_TYPE", settings_data.type)
-        if settings_data.type == "zilliz":
-            set_key(env_file, "ZILLIZ_URI", settings_data.zilliz_uri)
-            set_key(env_file, "ZILLIZ_API_KEY", settings_data.zilliz_api_key)
-        else:
-            set_key(env_file, "QDRANT_URL", settings_data.qdrant_url)
-            set_key(env_file, "QDRANT_API_KEY", settings_data.qdrant_api_key)
-        
-        # Reload settings to pick up persisted values
-        settings.reload()
+        # Persist changes to .env so they survive restarts, off the event loop
+        await asyncio.to_thread(_persist_settings, settings_data)
         
         # Log the update
         logger.info(f"Updated vector store settings: type={settings_data.type}")
         
         return {"message": "Vector store settings updated successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error updating vector store settings: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
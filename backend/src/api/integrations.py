@@ -1,12 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Body, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Request, BackgroundTasks
 from typing import List, Optional, Dict, Any
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
 import logging
-import traceback
+import asyncio
+import os
+import time
+from collections import deque
+from cachetools import TTLCache
 from pydantic import ValidationError
-import json
-import aiohttp
+import orjson
 
 from ..services.auth import get_current_user, User
 from ..models.integrations import (
@@ -17,25 +20,70 @@ from ..models.integrations import (
     WebsiteIntegration,
     SlackEventPayload
 )
-from ..db.firebase import FirestoreDB
+from ..db.firebase import get_firestore_db
 from ..services.integrations import slack_handler, website_handler
 
 # Configure logger
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
-firestore_db = FirestoreDB()
+firestore_db = get_firestore_db()
+
+# Per-team sliding window for Slack events, so a burst from one workspace
+# can't starve the others. Idle teams fall out of the cache after a minute.
+SLACK_EVENTS_PER_SECOND = int(os.getenv("SLACK_EVENTS_PER_SECOND", "20"))
+_slack_event_times = TTLCache(maxsize=10_000, ttl=60)
+
+# The team_id of a request that fails verification can't be trusted, so
+# those requests are limited per client IP instead
+SLACK_FAILURES_PER_SECOND = int(os.getenv("SLACK_FAILURES_PER_SECOND", "5"))
+_slack_failure_times = TTLCache(maxsize=10_000, ttl=60)
+
+def _recent_events(windows: TTLCache, key: str, now: float) -> deque:
+    """Get the times of a key's events in the last second, dropping older ones"""
+    window = windows.get(key) or deque()
+    while window and window[0] <= now - 1:
+        window.popleft()
+    return window
+
+def _slack_team_throttled(team_id: str) -> bool:
+    """Record a verified Slack event for a team and check its rate limit
+    
+    Args:
+        team_id: Slack team ID from the event payload
+        
+    Returns:
+        True if the team has already sent SLACK_EVENTS_PER_SECOND events
+        in the last second
+    """
+    now = time.monotonic()
+    window = _recent_events(_slack_event_times, team_id, now)
+    if len(window) >= SLACK_EVENTS_PER_SECOND:
+        return True
+    window.append(now)
+    _slack_event_times[team_id] = window
+    return False
+
+def _slack_client_blocked(client_ip: str) -> bool:
+    """Check whether a client sent SLACK_FAILURES_PER_SECOND unverified requests in the last second"""
+    return len(_recent_events(_slack_failure_times, client_ip, time.monotonic())) >= SLACK_FAILURES_PER_SECOND
+
+def _record_slack_failure(client_ip: str) -> None:
+    """Record a Slack request from a client that failed verification"""
+    now = time.monotonic()
+    window = _recent_events(_slack_failure_times, client_ip, now)
+    window.append(now)
+    _slack_failure_times[client_ip] = window
 
 @router.get("/", response_model=List[Integration])
 async def list_integrations(current_user: User = Depends(get_current_user)):
     """List all integrations for the current user"""
     try:
         # Get integrations from database
-        integrations = await firestore_db.list_integrations(current_user.id)
+        integrations = await firestore_db.list_integrations_cached(current_user.id)
         return integrations
     except Exception as e:
-        logger.error(f"Error listing integrations: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception(f"Error listing integrations: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to list integrations: {str(e)}"
@@ -44,6 +92,7 @@ async def list_integrations(current_user: User = Depends(get_current_user)):
 @router.post("/{type}", response_model=Integration)
 async def create_integration(
     type: str,
+    background_tasks: BackgroundTasks,
     integration_data: IntegrationCreate = Body(...),
     current_user: User = Depends(get_current_user)
 ):
@@ -67,16 +116,14 @@ async def create_integration(
         integration_id = str(uuid.uuid4())
         
         # Create integration in database
+        now = datetime.now(timezone.utc)
         integration_dict = {
+            **integration_data.model_dump(),  # type, name, chatbotId, config
             "id": integration_id,
-            "type": type,
-            "name": integration_data.name,
             "status": "pending",  # New integrations start as pending
             "userId": current_user.id,
-            "chatbotId": integration_data.chatbotId,
-            "config": integration_data.config,
-            "createdAt": datetime.now(),
-            "updatedAt": datetime.now()
+            "createdAt": now,
+            "updatedAt": now
         }
         
         # Use the appropriate handler to process the integration
@@ -84,6 +131,14 @@ async def create_integration(
         # For this example, we'll just create the integration
         await firestore_db.create_integration(integration_dict)
         
+        # Slack verification makes several Slack API calls, so it runs after
+        # the response is sent and the pending integration is returned now.
+        # Website processing stays inline because the client needs the DNS
+        # verification record from the response.
+        if type == "slack":
+            background_tasks.add_task(process_integration, type, integration_dict)
+            return integration_dict
+        
         # Process the integration based on type (simplified version)
         # In a real implementation, this would have more complexity
         result = await process_integration(type, integration_dict)
@@ -99,8 +154,7 @@ async def create_integration(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error creating integration: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception(f"Error creating integration: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to create integration: {str(e)}"
@@ -114,7 +168,7 @@ async def get_integration(
     """Get integration details"""
     try:
         # Get integration from database
-        integration = await firestore_db.get_integration(integration_id)
+        integration = await firestore_db.get_integration_cached(integration_id)
         
         if not integration:
             raise HTTPException(
@@ -133,8 +187,7 @@ async def get_integration(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error getting integration: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception(f"Error getting integration: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to get integration: {str(e)}"
@@ -175,13 +228,14 @@ async def update_integration(
         if integration_data.config is not None:
             update_data["config"] = integration_data.config
         
-        update_data["updatedAt"] = datetime.now()
+        update_data["updatedAt"] = datetime.now(timezone.utc)
         
         # Update integration in database
         await firestore_db.update_integration(integration_id, update_data)
         
-        # Get updated integration
-        updated_integration = await firestore_db.get_integration(integration_id)
+        # Merge the update into the integration we already read instead of
+        # reading it back
+        updated_integration = {**integration, **update_data}
         
         # Process the integration if status has changed to "active"
         if (
@@ -203,8 +257,7 @@ async def update_integration(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error updating integration: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception(f"Error updating integration: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to update integration: {str(e)}"
@@ -235,6 +288,7 @@ async def delete_integration(
         
         # Delete integration in database
         await firestore_db.delete_integration(integration_id)
+        slack_handler.invalidate_client(integration_id)
         
         # Clean up integration resources
         # In a real implementation, this would depend on the integration type
@@ -244,8 +298,7 @@ async def delete_integration(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error deleting integration: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception(f"Error deleting integration: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to delete integration: {str(e)}"
@@ -257,13 +310,12 @@ async def handle_slack_events(request: Request):
     try:
         # Get raw body for signature verification
         body = await request.body()
-        body_str = body.decode()
         
         # Log the incoming event for debugging
-        logger.info(f"Received Slack event: {body_str}")
+        logger.debug("Received Slack event: %d bytes", len(body))
         
-        # Parse event data
-        event_data = json.loads(body_str)
+        # Parse event data straight from the raw bytes
+        event_data = orjson.loads(body)
         
         # Handle URL verification challenge
         if event_data.get("type") == "url_verification":
@@ -291,6 +343,16 @@ async def handle_slack_events(request: Request):
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Missing team_id in event data"
             )
+        
+        # Reject clients that keep sending unverifiable requests before
+        # spending a Firestore read on them
+        client_ip = request.client.host if request.client else "unknown"
+        if _slack_client_blocked(client_ip):
+            logger.warning(f"Throttling unverified Slack requests from {client_ip}")
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many invalid requests"
+            )
             
         # Log that we're searching for the integration
         logger.info(f"Searching for integration with team_id: {team_id}")
@@ -299,14 +361,13 @@ async def handle_slack_events(request: Request):
         integrations = await firestore_db.list_integrations_by_query(
             field_path="config.team_id",
             op_string="==",
-            value=team_id
+            value=team_id,
+            limit=1
         )
         
         if not integrations:
             logger.error(f"No integration found for team_id: {team_id}")
-            # List all integrations for debugging
-            all_integrations = await firestore_db.list_integrations(None)  # Pass None to get all integrations
-            logger.error(f"Available integrations: {json.dumps(all_integrations, indent=2)}")
+            _record_slack_failure(client_ip)
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Integration not found"
@@ -322,47 +383,57 @@ async def handle_slack_events(request: Request):
         
         if not bot_token or not signing_secret:
             logger.error("Missing Slack credentials in integration config")
-            logger.error(f"Integration config: {json.dumps(config, indent=2)}")
+            # Log only the key names; the config holds the bot token and signing secret
+            logger.error("Integration config keys: %s", sorted(config))
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Integration not properly configured"
             )
             
-        # Get chatbot settings if available
-        chatbot_id = integration.get("chatbotId")
-        chatbot_settings = None
-        if chatbot_id:
-            chatbot = await firestore_db.get_chatbot(chatbot_id)
-            if chatbot and "settings" in chatbot:
-                chatbot_settings = chatbot["settings"]
-                logger.info(f"Using chatbot settings from chatbot: {chatbot_id}")
-            else:
-                logger.warning(f"No settings found for chatbot: {chatbot_id}")
-        else:
-            logger.warning("No chatbot ID associated with this integration")
-        
-        # Set up Slack handler with credentials and settings
-        slack_handler.set_credentials(bot_token, signing_secret, chatbot_settings)
-        
-        # Verify request is from Slack
+        # Verify request is from Slack. This is a local HMAC check, so it runs
+        # before the chatbot read and forged requests cost no Firestore read.
+        slack_client = slack_handler.get_client(integration["id"], bot_token, signing_secret)
         is_valid = await slack_handler.verify_request_signature(
+            slack_client,
             timestamp=timestamp,
             signature=signature,
-            body=body_str
+            body=body
         )
         
         if not is_valid:
             logger.error("Invalid Slack signature")
             logger.error(f"Timestamp: {timestamp}")
             logger.error(f"Signature: {signature}")
+            _record_slack_failure(client_ip)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid Slack signature"
             )
         
+        # Throttle verified events per team before any LLM work. Only signed
+        # events count, so forged ones can't use up a team's budget. Slack
+        # retries non-2xx responses, so throttled events are acknowledged
+        # with a 200.
+        if _slack_team_throttled(team_id):
+            logger.warning(f"Throttling Slack events for team_id: {team_id}")
+            return {"status": "throttled"}
+        
+        # Get chatbot settings if available
+        chatbot_id = integration.get("chatbotId")
+        chatbot_settings = None
+        if chatbot_id:
+            chatbot = await firestore_db.get_chatbot_cached(chatbot_id)
+            if chatbot and "settings" in chatbot:
+                chatbot_settings = chatbot["settings"]
+                logger.info(f"Using chatbot settings from chatbot: {chatbot_id}")
+            else:
+                logger.warning(f"No settings found for chatbot: {chatbot_id}")
+        else:
+            logger.warning("No chatbot ID associated with this integration")
+        
         # Handle the event
         logger.info("Processing Slack event")
-        result = await slack_handler.handle_event(event_data)
+        result = await slack_handler.handle_event(event_data, slack_client, chatbot_settings)
         
         if result:
             logger.info(f"Event handled successfully: {result}")
@@ -371,7 +442,7 @@ async def handle_slack_events(request: Request):
         logger.info("Event processed successfully")
         return {"status": "ok"}
         
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         logger.error(f"Invalid JSON payload: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -380,8 +451,7 @@ async def handle_slack_events(request: Request):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error handling Slack event: {str(e)}")
-        logger.error(f"Traceback: {traceback.format_exc()}")
+        logger.exception(f"Error handling Slack event: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to process Slack event: {str(e)}"
@@ -430,13 +500,11 @@ async def update_slack_credentials(
         
         # Verify bot token and get team info
         try:
-            session = aiohttp.ClientSession()
-            headers = {
-                "Authorization": f"Bearer {bot_token}",
-                "Content-Type": "application/json"
-            }
+            session = await slack_handler._get_session()
+            slack_handler.invalidate_client(integration_id)
+            slack_client = slack_handler.get_client(integration_id, bot_token, signing_secret)
             
-            async with session.post("https://slack.com/api/auth.test", headers=headers) as response:
+            async with session.post("https://slack.com/api/auth.test", headers=slack_client.headers) as response:
                 data = await response.json()
                 if not data.get("ok"):
                     raise HTTPException(
@@ -444,7 +512,8 @@ async def update_slack_credentials(
                         detail=f"Invalid bot token: {data.get('error')}"
                     )
                 
-                # Update config with credentials and team info
+                # Update config with credentials and team info; it is saved
+                # together with the status by process_integration below
                 config = integration.get("config", {})
                 config.update({
                     "bot_token": bot_token,
@@ -452,28 +521,20 @@ async def update_slack_credentials(
                     "team_id": data.get("team_id"),
                     "team_name": data.get("team")
                 })
-                
-                # Update integration with verified credentials
-                await firestore_db.update_integration(
-                    integration_id,
-                    {
-                        "config": config,
-                        "updatedAt": datetime.now(),
-                        "status": "pending"  # Reset status to let process_integration verify everything
-                    }
-                )
         except Exception as e:
             logger.error(f"Error verifying Slack credentials: {str(e)}")
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Failed to verify Slack credentials: {str(e)}"
             )
-        finally:
-            if session and not session.closed:
-                await session.close()
         
-        # Reprocess integration
-        updated_integration = await firestore_db.get_integration(integration_id)
+        # Reprocess integration with the verified credentials
+        updated_integration = {
+            **integration,
+            "config": config,
+            "status": "pending",  # Reset status to let process_integration verify everything
+            "error": None
+        }
         result = await process_integration("slack", updated_integration)
         
         return result
@@ -481,27 +542,86 @@ async def update_slack_credentials(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error updating Slack credentials: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception(f"Error updating Slack credentials: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to update credentials: {str(e)}"
         )
 
+async def _verify_slack_integration(
+    integration_data: Dict[str, Any],
+    config: Dict[str, Any],
+    bot_token: str,
+    signing_secret: str
+) -> None:
+    """Check a Slack integration's credentials and send a test message
+    
+    Sets the status (and error, if any) on integration_data; the caller
+    stores the result.
+    """
+    slack_client = slack_handler.get_client(integration_data["id"], bot_token, signing_secret)
+    headers = slack_client.headers
+    
+    # First, verify the bot token by making a simple auth.test API call
+    try:
+        session = await slack_handler._get_session()
+        
+        async def slack_call(method: str, url: str) -> Dict[str, Any]:
+            async with session.request(method, url, headers=headers) as response:
+                return await response.json()
+        
+        # Call auth.test to verify the token and team.info for
+        # additional team details at the same time; they are independent
+        auth_data, team_data = await asyncio.gather(
+            slack_call("POST", "https://slack.com/api/auth.test"),
+            slack_call("GET", "https://slack.com/api/team.info"),
+            return_exceptions=True
+        )
+        
+        if isinstance(auth_data, Exception):
+            raise auth_data
+        if auth_data.get("ok"):
+            # Save the team_id and team_name from auth.test response
+            config["team_id"] = auth_data.get("team_id")
+            config["team_name"] = auth_data.get("team")
+            integration_data["config"] = config
+        else:
+            logger.error(f"Error verifying bot token: {auth_data.get('error')}")
+            integration_data["status"] = "error"
+            integration_data["error"] = f"Invalid bot token: {auth_data.get('error')}"
+            return
+        
+        # team.info needs an extra scope, so a failure here doesn't
+        # fail the integration
+        if isinstance(team_data, Exception):
+            logger.warning(f"Could not get additional team info: {str(team_data)}")
+        elif not team_data.get("ok"):
+            logger.warning(f"Could not get additional team info: {team_data.get('error')}")
+        elif not config.get("team_name"):
+            # Update with additional team info if available
+            config["team_name"] = team_data.get("team", {}).get("name")
+            integration_data["config"] = config
+        
+        # Send a test message
+        channel = config.get("default_channel", "general")
+        test_message = "🎉 ChatSphere bot has been successfully connected! I'm here to help."
+        
+        success = await slack_handler._send_bot_message(slack_client, channel, test_message)
+        if success:
+            integration_data["status"] = "active"
+        else:
+            integration_data["status"] = "error"
+            integration_data["error"] = "Failed to send test message"
+            
+    except Exception as e:
+        logger.error(f"Error testing Slack integration: {str(e)}")
+        integration_data["status"] = "error"
+        integration_data["error"] = str(e)
+
 # Helper function to process integrations based on type
 async def process_integration(integration_type: str, integration_data: Dict[str, Any]) -> Integration:
     """Process an integration based on its type"""
     try:
-        # Get chatbot settings if available
-        chatbot_id = integration_data.get("chatbotId")
-        chatbot_settings = None
-        
-        if chatbot_id:
-            # Get chatbot from database
-            chatbot = await firestore_db.get_chatbot(chatbot_id)
-            if chatbot and "settings" in chatbot:
-                chatbot_settings = chatbot["settings"]
-        
         if integration_type == "slack":
             config = integration_data.get("config", {})
             bot_token = config.get("bot_token")
@@ -511,73 +631,19 @@ async def process_integration(integration_type: str, integration_data: Dict[str,
                 logger.warning("Slack integration missing required credentials")
                 integration_data["status"] = "error"
                 integration_data["error"] = "Missing required credentials"
-                return integration_data
-            
-            # Set up Slack handler with credentials and chatbot settings
-            slack_handler.set_credentials(bot_token, signing_secret, chatbot_settings)
-            
-            # First, verify the bot token by making a simple auth.test API call
-            try:
-                session = await slack_handler._get_session()
-                headers = {
-                    "Authorization": f"Bearer {bot_token}",
-                    "Content-Type": "application/json"
-                }
-                
-                # Call auth.test to verify token and get team info
-                async with session.post("https://slack.com/api/auth.test", headers=headers) as response:
-                    data = await response.json()
-                    if data.get("ok"):
-                        # Save the team_id and team_name from auth.test response
-                        config["team_id"] = data.get("team_id")
-                        config["team_name"] = data.get("team")
-                        integration_data["config"] = config
-                    else:
-                        logger.error(f"Error verifying bot token: {data.get('error')}")
-                        integration_data["status"] = "error"
-                        integration_data["error"] = f"Invalid bot token: {data.get('error')}"
-                        return integration_data
-                
-                # Try to get additional team info if we have the right scope
-                try:
-                    async with session.get("https://slack.com/api/team.info", headers=headers) as response:
-                        data = await response.json()
-                        if data.get("ok"):
-                            team = data.get("team", {})
-                            # Update with additional team info if available
-                            if not config.get("team_name"):
-                                config["team_name"] = team.get("name")
-                            integration_data["config"] = config
-                except Exception as e:
-                    # Log the error but don't fail the integration
-                    logger.warning(f"Could not get additional team info: {str(e)}")
-                
-                # Send a test message
-                channel = config.get("default_channel", "general")
-                test_message = "🎉 ChatSphere bot has been successfully connected! I'm here to help."
-                
-                success = await slack_handler._send_bot_message(channel, test_message)
-                if success:
-                    integration_data["status"] = "active"
-                else:
-                    integration_data["status"] = "error"
-                    integration_data["error"] = "Failed to send test message"
-                    
-            except Exception as e:
-                logger.error(f"Error testing Slack integration: {str(e)}")
-                integration_data["status"] = "error"
-                integration_data["error"] = str(e)
+            else:
+                await _verify_slack_integration(integration_data, config, bot_token, signing_secret)
 
-            # Always update the integration in the database with the latest config
-            if config.get("team_id"):
-                await firestore_db.update_integration(
-                    integration_data["id"],
-                    {
-                        "config": config,
-                        "status": integration_data["status"],
-                        "error": integration_data.get("error")
-                    }
-                )
+            # Save the latest config, status and error in a single write
+            await firestore_db.update_integration(
+                integration_data["id"],
+                {
+                    "config": config,
+                    "status": integration_data["status"],
+                    "error": integration_data.get("error"),
+                    "updatedAt": firestore_db.server_timestamp()
+                }
+            )
 
             return integration_data
 
@@ -641,8 +707,7 @@ async def process_integration(integration_type: str, integration_data: Dict[str,
         
         return integration_data
     except Exception as e:
-        logger.error(f"Error processing {integration_type} integration: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception(f"Error processing {integration_type} integration: {str(e)}")
         integration_data["status"] = "error"
         integration_data["config"]["error"] = str(e)
         
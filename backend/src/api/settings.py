@@ -1,12 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Body
-from typing import Dict, Any, Optional
+from typing import Dict, Any
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
 import uuid
 import traceback
 
 from ..services.auth import get_current_user, User
-from ..db.firebase import FirestoreDB
+from ..db.firebase import get_firestore_db, build_default_settings
 from ..utils.logging import get_logger
 from src.api.endpoints.settings import router as vector_store_router
 
@@ -14,7 +14,7 @@ from src.api.endpoints.settings import router as vector_store_router
 logger = get_logger(__name__)
 
 router = APIRouter()
-firestore_db = FirestoreDB()
+firestore_db = get_firestore_db()
 
 # Include vector store settings router
 router.include_router(vector_store_router, prefix="/vector-store", tags=["vector-store"])
@@ -23,38 +23,12 @@ router.include_router(vector_store_router, prefix="/vector-store", tags=["vector
 async def get_user_settings(current_user: User = Depends(get_current_user)):
     """Get the settings for the current user"""
     try:
-        # Get user settings from database
-        settings = await firestore_db.get_user_settings(current_user.id)
-        
-        # If settings don't exist, create default settings
-        if not settings:
-            default_settings = {
-                "userId": current_user.id,
-                "email": current_user.email,
-                "displayName": current_user.display_name,
-                "theme": "light",
-                "notifications": {
-                    "email": True,
-                    "inApp": True
-                },
-                "apiKey": str(uuid.uuid4()),
-                "usage": {
-                    "messagesUsed": 0,
-                    "documentsUploaded": 0,
-                    "storageUsed": 0
-                },
-                "subscription": {
-                    "plan": "free"
-                },
-                "createdAt": datetime.now(),
-                "updatedAt": datetime.now()
-            }
-            
-            # Create settings in database
-            await firestore_db.create_user_settings(default_settings)
-            return default_settings
-        
-        return settings
+        # Get user settings from database, creating default settings on
+        # first use
+        return await firestore_db.get_or_create_user_settings(
+            current_user.id,
+            lambda: build_default_settings(current_user.id, current_user.email, current_user.display_name)
+        )
     except Exception as e:
         logger.error(f"Error getting user settings: {str(e)}")
         logger.error(traceback.format_exc())
@@ -70,8 +44,11 @@ async def update_user_settings(
 ):
     """Update the settings for the current user"""
     try:
-        # Get current settings
-        current_settings = await firestore_db.get_user_settings(current_user.id)
+        # Get current settings, creating default settings first if needed
+        current_settings = await firestore_db.get_or_create_user_settings(
+            current_user.id,
+            lambda: build_default_settings(current_user.id, current_user.email, current_user.display_name)
+        )
         
         # Validate that we're not updating protected fields
         protected_fields = {"userId", "apiKey", "createdAt", "subscription", "usage"}
@@ -79,44 +56,16 @@ async def update_user_settings(
             if field in settings_data:
                 settings_data.pop(field)
         
-        # If settings don't exist, create default settings first
-        if not current_settings:
-            default_settings = {
-                "userId": current_user.id,
-                "email": current_user.email,
-                "displayName": current_user.display_name,
-                "theme": "light",
-                "notifications": {
-                    "email": True,
-                    "inApp": True
-                },
-                "apiKey": str(uuid.uuid4()),
-                "usage": {
-                    "messagesUsed": 0,
-                    "documentsUploaded": 0,
-                    "storageUsed": 0
-                },
-                "subscription": {
-                    "plan": "free"
-                },
-                "createdAt": datetime.now(),
-                "updatedAt": datetime.now()
-            }
-            await firestore_db.create_user_settings(default_settings)
-            current_settings = default_settings
-        
         # Update settings
         update_data = {
             **settings_data,
-            "updatedAt": datetime.now()
+            "updatedAt": datetime.now(timezone.utc)
         }
         
         await firestore_db.update_user_settings(current_user.id, update_data)
         
-        # Get updated settings
-        updated_settings = await firestore_db.get_user_settings(current_user.id)
-        
-        return updated_settings
+        # Return the merged settings instead of reading them back
+        return {**current_settings, **update_data}
     except Exception as e:
         logger.error(f"Error updating user settings: {str(e)}")
         logger.error(traceback.format_exc())
@@ -135,7 +84,7 @@ async def regenerate_api_key(current_user: User = Depends(get_current_user)):
         # Update the user settings with the new API key
         update_data = {
             "apiKey": new_api_key,
-            "updatedAt": datetime.now()
+            "updatedAt": firestore_db.server_timestamp()
         }
         
         # Update settings in database
@@ -4,7 +4,7 @@ from pydantic import BaseModel
 import logging
 import traceback
 
-from ..db.firebase import FirestoreDB, FirebaseAuth
+from ..db.firebase import get_firestore_db, get_firebase_auth
 from ..services.auth import get_current_user, User
 from ..utils.logging import get_logger
 
@@ -12,8 +12,8 @@ from ..utils.logging import get_logger
 logger = get_logger(__name__)
 
 router = APIRouter()
-firestore_db = FirestoreDB()
-firebase_auth = FirebaseAuth()
+firestore_db = get_firestore_db()
+firebase_auth = get_firebase_auth()
 
 # User profile model
 class UserProfile(BaseModel):
@@ -34,7 +34,7 @@ async def get_user_profile(current_user: User = Depends(get_current_user)):
         logger.info(f"Getting profile for user: {current_user.id}")
         
         # Get user data from database
-        user_data = await firestore_db.get_user(current_user.id)
+        user_data = await firestore_db.get_user_cached(current_user.id)
         
         if not user_data:
             # User exists in auth but not in database, create basic profile
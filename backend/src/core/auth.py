@@ -1,9 +1,10 @@
 from fastapi import Depends, HTTPException, status
 import logging
-from ..db.firebase import FirebaseAuth
+from ..db.firebase import get_firebase_auth
+from .auth_cache import verify_token_cached
 
 logger = logging.getLogger(__name__)
-firebase_auth = FirebaseAuth()
+firebase_auth = get_firebase_auth()
 
 async def get_current_user_id(token: str = Depends(firebase_auth.oauth2_scheme)):
     """
@@ -21,7 +22,7 @@ async def get_current_user_id(token: str = Depends(firebase_auth.oauth2_scheme))
         if token.startswith('Bearer '):
             token = token.split(' ')[1]
             
-        token_data = await firebase_auth.verify_token(token)
+        token_data = await verify_token_cached(token, firebase_auth.verify_token)
         
         # Extract uid from token data
         if isinstance(token_data, dict):
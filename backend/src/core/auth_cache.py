@@ -0,0 +1,57 @@
+import hashlib
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from cachetools import TTLCache
+
+# Verified token claims keyed by SHA-256 of the raw token. Entries never
+# outlive the token's own expiry.
+_token_cache = TTLCache(maxsize=10_000, ttl=30)
+
+def _token_key(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+def get_cached_token_payload(token: str) -> Optional[Dict[str, Any]]:
+    """Get previously verified claims for a token
+
+    Args:
+        token: Raw ID token
+
+    Returns:
+        Decoded claims, or None if the token is not cached or has expired
+    """
+    key = _token_key(token)
+    payload = _token_cache.get(key)
+    if payload is None:
+        return None
+
+    exp = payload.get("exp")
+    if exp is not None and exp <= time.time():
+        _token_cache.pop(key, None)
+        return None
+
+    return payload
+
+async def verify_token_cached(
+    token: str,
+    verify: Callable[[str], Awaitable[Dict[str, Any]]]
+) -> Dict[str, Any]:
+    """Verify a token, reusing the result of a recent verification
+
+    Args:
+        token: Raw ID token
+        verify: Coroutine function that verifies the token and returns its claims
+
+    Returns:
+        Decoded token claims
+    """
+    payload = get_cached_token_payload(token)
+    if payload is not None:
+        return payload
+
+    payload = await verify(token)
+    if isinstance(payload, dict):
+        exp = payload.get("exp")
+        if exp is None or exp > time.time():
+            _token_cache[_token_key(token)] = payload
+    return payload
@@ -52,6 +52,15 @@ class Settings(BaseSettings):
     # Document processing settings
     CHUNK_SIZE: int = 1000
     CHUNK_OVERLAP: int = 200
+    MAX_UPLOAD_SIZE: int = 50 * 1024 * 1024
+    
+    # Seconds after its last update that a pending or processing document
+    # is treated as stuck (e.g. its job was lost in a restart) and may be
+    # claimed again
+    DOCUMENT_PROCESSING_TIMEOUT: int = 1800
+    
+    # Seconds user profiles and settings are served from the in-process cache
+    PROFILE_CACHE_TTL: int = 60
     
     # Firecrawl settings
     FIRECRAWL_API_KEY: Optional[str] = None
@@ -5,13 +5,12 @@ import logging
 
 from .config import settings
 from .security import get_current_user, get_optional_user
-from ..db.firebase import FirebaseAuth, FirestoreDB, firestore_db
+from ..db.firebase import get_firebase_auth, firestore_db
 
 logger = logging.getLogger(__name__)
 
 # Initialize Firebase Auth
-firebase_auth = FirebaseAuth()
-firestore_db = FirestoreDB()
+firebase_auth = get_firebase_auth()
 
 # OAuth2 password bearer for token authentication
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
@@ -41,7 +40,7 @@ async def get_optional_user_id(token: Optional[str] = Depends(oauth2_scheme)) ->
     """
     return await get_optional_user(token)
 
-async def validate_document_owner(document_id: str, user_id: str) -> bool:
+async def validate_document_owner(document_id: str, user_id: str) -> Dict[str, Any]:
     """Validate that the user owns the document
     
     Args:
@@ -49,12 +48,12 @@ async def validate_document_owner(document_id: str, user_id: str) -> bool:
         user_id: User ID
         
     Returns:
-        True if user owns the document
+        The document, so callers don't need to fetch it again
         
     Raises:
         HTTPException: If document not found or user does not own the document
     """
-    document = await firestore_db.get_document(document_id)
+    document = await firestore_db.get_owned_document(document_id, user_id)
     
     if not document:
         raise HTTPException(
@@ -62,15 +61,9 @@ async def validate_document_owner(document_id: str, user_id: str) -> bool:
             detail="Document not found"
         )
     
-    if document.get("ownerId") != user_id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized to access this document"
-        )
-    
-    return True
+    return document
 
-async def validate_chatbot_owner(chatbot_id: str, user_id: str) -> bool:
+async def validate_chatbot_owner(chatbot_id: str, user_id: str) -> Dict[str, Any]:
     """Validate that the user owns the chatbot
     
     Args:
@@ -78,12 +71,13 @@ async def validate_chatbot_owner(chatbot_id: str, user_id: str) -> bool:
         user_id: User ID
         
     Returns:
-        True if user owns the chatbot
+        The chatbot, so callers don't need to fetch it again. It may come
+        from the shared chatbot cache and must not be mutated.
         
     Raises:
         HTTPException: If chatbot not found or user does not own the chatbot
     """
-    chatbot = await firestore_db.get_chatbot(chatbot_id)
+    chatbot = await firestore_db.get_chatbot_cached(chatbot_id)
     
     if not chatbot:
         raise HTTPException(
@@ -97,9 +91,9 @@ async def validate_chatbot_owner(chatbot_id: str, user_id: str) -> bool:
             detail="Not authorized to access this chatbot"
         )
     
-    return True
+    return chatbot
 
-async def validate_chat_session_owner(session_id: str, user_id: str) -> bool:
+async def validate_chat_session_owner(session_id: str, user_id: str) -> Dict[str, Any]:
     """Validate that the user owns the chat session
     
     Args:
@@ -107,7 +101,7 @@ async def validate_chat_session_owner(session_id: str, user_id: str) -> bool:
         user_id: User ID
         
     Returns:
-        True if user owns the chat session
+        The chat session, so callers don't need to fetch it again
         
     Raises:
         HTTPException: If chat session not found or user does not own the chat session
@@ -126,7 +120,7 @@ async def validate_chat_session_owner(session_id: str, user_id: str) -> bool:
             detail="Not authorized to access this chat session"
         )
     
-    return True
+    return session
 
 async def get_chatbot_or_404(chatbot_id: str) -> Dict[str, Any]:
     """Get a chatbot by ID or raise 404"""
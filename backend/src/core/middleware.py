@@ -2,14 +2,18 @@ from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
 from datetime import datetime, timedelta
-from typing import Dict, Tuple
+from typing import Deque, Dict, Tuple
+from collections import deque
+from cachetools import TTLCache
 import time
 
 class RateLimitMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app: FastAPI, requests_per_minute: int = 60):
+    def __init__(self, app: FastAPI, requests_per_minute: int = 60, max_keys: int = 100_000):
         super().__init__(app)
         self.requests_per_minute = requests_per_minute
-        self.requests: Dict[Tuple[str, str], list] = {}
+        # Keys idle for a full window are evicted, and the number of tracked
+        # (IP, path) pairs is capped, so memory stays bounded
+        self.requests: Dict[Tuple[str, str], Deque[float]] = TTLCache(maxsize=max_keys, ttl=60)
     
     async def dispatch(self, request: Request, call_next):
         # Get client IP and endpoint path
@@ -20,13 +24,15 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         # Get current timestamp
         now = time.time()
         
-        # Initialize or clean up old requests
-        if key not in self.requests:
-            self.requests[key] = []
-        self.requests[key] = [ts for ts in self.requests[key] if ts > now - 60]
+        # Initialize or clean up old requests. Timestamps are appended in
+        # order, so expired ones are always at the left end.
+        timestamps = self.requests.get(key) or deque()
+        cutoff = now - 60
+        while timestamps and timestamps[0] <= cutoff:
+            timestamps.popleft()
         
         # Check rate limit
-        if len(self.requests[key]) >= self.requests_per_minute:
+        if len(timestamps) >= self.requests_per_minute:
             return JSONResponse(
                 status_code=429,
                 content={
@@ -36,7 +42,9 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
             )
         
         # Add current request timestamp
-        self.requests[key].append(now)
+        timestamps.append(now)
+        # Re-store the key to restart its idle timer
+        self.requests[key] = timestamps
         
         # Process the request
         response = await call_next(request)
@@ -4,7 +4,11 @@ from typing import Optional
 import os
 
 from .config import settings
-from ..db.firebase import FirebaseAuth
+from ..db.firebase import get_firebase_auth
+from .auth_cache import verify_token_cached
+
+# Process-wide FirebaseAuth, shared with core.auth and core.dependencies
+firebase_auth = get_firebase_auth()
 
 # OAuth2 password bearer for token authentication
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
@@ -22,8 +26,7 @@ async def get_current_user(token: str) -> str:
         HTTPException: If token is invalid
     """
     try:
-        firebase_auth = FirebaseAuth()
-        user_id = await firebase_auth.verify_token(token)
+        user_id = await verify_token_cached(token, firebase_auth.verify_token)
         return user_id
     except Exception as e:
         raise HTTPException(
@@ -45,8 +48,7 @@ async def get_optional_user(token: Optional[str] = None) -> Optional[str]:
         return None
     
     try:
-        firebase_auth = FirebaseAuth()
-        user_id = await firebase_auth.verify_token(token)
+        user_id = await verify_token_cached(token, firebase_auth.verify_token)
         return user_id
     except Exception:
         return None
\ No newline at end of file
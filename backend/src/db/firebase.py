@@ -1,18 +1,150 @@
 from fastapi import UploadFile
 import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 import firebase_admin
 from firebase_admin import credentials, firestore, storage, auth
-from typing import Dict, Any, List, Optional
-from datetime import datetime
+from google.cloud.firestore_v1.field_path import FieldPath
+from google.api_core import exceptions as google_exceptions
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from typing import Callable, Dict, Any, List, Optional
+from datetime import datetime, timedelta, timezone
 import tempfile
+import uuid
 from fastapi import HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from ..core.config import settings
+from ..utils.cache import AsyncTTLCache
 import logging
 import traceback
 
 logger = logging.getLogger(__name__)
 
+# Errors Firestore raises for contention or throttling; safe to retry
+TRANSIENT_FIRESTORE_ERRORS = (
+    google_exceptions.Aborted,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.ServiceUnavailable,
+)
+
+# Retry transient failures up to 3 attempts with jittered exponential backoff
+firestore_retry = retry(
+    retry=retry_if_exception_type(TRANSIENT_FIRESTORE_ERRORS),
+    stop=stop_after_attempt(3),
+    wait=wait_random_exponential(multiplier=0.1, max=2),
+    reraise=True
+)
+
+# Resumable upload chunk size; must be a multiple of 256 KiB
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Chatbot configs are read on every chat turn but change rarely
+_chatbot_cache = AsyncTTLCache(maxsize=1024, ttl=60)
+
+# Document metadata is re-read for ownership checks on every documents
+# endpoint; keep the TTL short since processing status changes often
+_document_cache = AsyncTTLCache(maxsize=1024, ttl=10)
+
+# Integrations are polled by the dashboard but only change through
+# FirestoreDB writes, which invalidate these caches
+_integration_cache = AsyncTTLCache(maxsize=1024, ttl=30)
+_integration_list_cache = AsyncTTLCache(maxsize=1024, ttl=30)
+
+# User profiles and settings are fetched on every dashboard load but only
+# change through FirestoreDB writes, which invalidate these caches
+_user_cache = AsyncTTLCache(maxsize=10_000, ttl=settings.PROFILE_CACHE_TTL)
+_user_settings_cache = AsyncTTLCache(maxsize=10_000, ttl=settings.PROFILE_CACHE_TTL)
+
+def _invalidate_integration(integration_id: str, user_id: Optional[str] = None) -> None:
+    """Drop an integration and its owner's integration list from the caches"""
+    cached = _integration_cache.get(integration_id)
+    _integration_cache.invalidate(integration_id)
+    user_id = user_id or (cached or {}).get('userId')
+    if user_id:
+        _integration_list_cache.invalidate(user_id)
+    else:
+        # Owner unknown, so no list can be trusted to be current
+        _integration_list_cache.clear()
+
+def _is_stale(updated_at: Any, stale_after: Optional[float]) -> bool:
+    """Whether a document last updated at updated_at is older than stale_after seconds"""
+    if stale_after is None:
+        return False
+    if not isinstance(updated_at, datetime):
+        # No usable timestamp, so nothing shows the document is still being worked on
+        return True
+    if updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) - updated_at > timedelta(seconds=stale_after)
+
+# Dedicated pool for blocking Firestore/Storage SDK calls, so they don't
+# compete with other to_thread work for the default executor
+_firestore_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("FIRESTORE_WORKERS", "40")),
+    thread_name_prefix="firestore"
+)
+
+async def _run_blocking(func, *args, **kwargs):
+    """Run a blocking Firestore SDK call in a worker thread so it doesn't stall the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_firestore_executor, functools.partial(func, *args, **kwargs))
+
+class BatchWriter:
+    """Coalesce concurrent document writes into shared WriteBatch commits.
+
+    Writes queued within `window` seconds of the first one (up to
+    `max_items`) are committed together; each caller still awaits the
+    outcome of its own commit. A failed commit fails every write in it.
+    """
+
+    def __init__(self, db, window: float = 0.005, max_items: int = 400):
+        self._db = db
+        self._window = window
+        self._max_items = max_items
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def set(self, ref, data: Dict[str, Any], merge: bool = False) -> None:
+        """Queue a document set and wait until its batch is committed"""
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((ref, data, merge, future))
+        await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self._queue.get()]
+            deadline = loop.time() + self._window
+            while len(pending) < self._max_items:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            batch = self._db.batch()
+            for ref, data, merge, _ in pending:
+                batch.set(ref, data, merge=merge)
+
+            try:
+                await _run_blocking(batch.commit)
+            except Exception as e:
+                logger.error(f"Batched commit of {len(pending)} writes failed: {str(e)}")
+                for *_, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for *_, future in pending:
+                    if not future.done():
+                        future.set_result(None)
+
 class FirebaseApp:
     _instance = None
     _initialized = False
@@ -47,38 +179,109 @@ class FirebaseApp:
 # Initialize Firebase singleton
 firebase_app = FirebaseApp.get_instance()
 
+def build_default_settings(user_id: str, email: Optional[str], display_name: Optional[str]) -> Dict[str, Any]:
+    """Build the settings document a new user starts with"""
+    now = datetime.now(timezone.utc)
+    return {
+        "userId": user_id,
+        "email": email,
+        "displayName": display_name,
+        "theme": "light",
+        "notifications": {
+            "email": True,
+            "inApp": True
+        },
+        "apiKey": str(uuid.uuid4()),
+        "usage": {
+            "messagesUsed": 0,
+            "documentsUploaded": 0,
+            "storageUsed": 0
+        },
+        "subscription": {
+            "plan": "free"
+        },
+        "createdAt": now,
+        "updatedAt": now
+    }
+
 # Firestore operations
 class FirestoreDB:
     def __init__(self):
         self.app = firebase_app.app
         self.db = firebase_app.db
+        self.writer = BatchWriter(self.db)
+    
+    async def warm(self) -> None:
+        """Open the Firestore channel before the first request needs it"""
+        await _run_blocking(self.db.collection('_warm').document('_').get)
     
     # User operations
     async def create_user(self, user_data: Dict[str, Any]) -> str:
         """Create a new user in Firestore"""
         user_ref = self.db.collection('users').document(user_data['uid'])
-        user_ref.set({
+        await _run_blocking(user_ref.set, {
             **user_data,
             'createdAt': firestore.SERVER_TIMESTAMP,
             'lastLogin': firestore.SERVER_TIMESTAMP
         })
+        _user_cache.invalidate(user_data['uid'])
         return user_data['uid']
     
+    @staticmethod
+    def server_timestamp():
+        """Sentinel telling Firestore to store the commit time"""
+        return firestore.SERVER_TIMESTAMP
+    
+    def batch(self):
+        """Start a write batch. A batch holds at most 500 operations."""
+        return self.db.batch()
+    
+    async def create_user_with_settings(self, user_data: Dict[str, Any], settings_data: Dict[str, Any]) -> str:
+        """Create a user document and its settings document in one commit
+        
+        Args:
+            user_data: User data, must include uid
+            settings_data: Initial settings for the user
+            
+        Returns:
+            The user ID
+        """
+        user_id = user_data['uid']
+        batch = self.batch()
+        batch.set(self.db.collection('users').document(user_id), {
+            **user_data,
+            'createdAt': firestore.SERVER_TIMESTAMP,
+            'lastLogin': firestore.SERVER_TIMESTAMP
+        })
+        batch.set(self.db.collection('settings').document(user_id), settings_data)
+        await _run_blocking(batch.commit)
+        _user_cache.invalidate(user_id)
+        _user_settings_cache.invalidate(user_id)
+        return user_id
+    
     async def get_user(self, user_id: str) -> Optional[Dict[str, Any]]:
         """Get user data from Firestore"""
         user_ref = self.db.collection('users').document(user_id)
-        user = user_ref.get()
+        user = await _run_blocking(user_ref.get)
         if user.exists:
             return user.to_dict()
         return None
     
+    async def get_user_cached(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get user data, served from a short-lived in-process cache
+        
+        The cached dict is shared, so callers must not mutate it.
+        """
+        return await _user_cache.get_or_fetch(user_id, lambda: self.get_user(user_id))
+    
     async def update_user(self, user_id: str, user_data: Dict[str, Any]) -> bool:
         """Update user data in Firestore"""
         user_ref = self.db.collection('users').document(user_id)
-        user_ref.update({
+        await _run_blocking(user_ref.update, {
             **user_data,
             'updatedAt': firestore.SERVER_TIMESTAMP
         })
+        _user_cache.invalidate(user_id)
         return True
     
     # Chatbot operations
@@ -95,51 +298,77 @@ class FirestoreDB:
             chatbot_id = chatbot_ref.id
             chatbot_data['id'] = chatbot_id
         
-        # Set the data
-        chatbot_ref.set({
+        # Set the data, sharing a commit with any concurrent creates
+        await self.writer.set(chatbot_ref, {
             **chatbot_data,
             'createdAt': firestore.SERVER_TIMESTAMP,
             'updatedAt': firestore.SERVER_TIMESTAMP
         })
         return chatbot_id
     
+    @firestore_retry
     async def get_chatbot(self, chatbot_id: str) -> Optional[Dict[str, Any]]:
         """Get chatbot data from Firestore"""
         chatbot_ref = self.db.collection('chatbots').document(chatbot_id)
-        chatbot = chatbot_ref.get()
+        chatbot = await _run_blocking(chatbot_ref.get)
         if chatbot.exists:
             return chatbot.to_dict()
         return None
     
+    async def get_chatbot_cached(self, chatbot_id: str) -> Optional[Dict[str, Any]]:
+        """Get chatbot data, served from a short-lived in-process cache"""
+        return await _chatbot_cache.get_or_fetch(chatbot_id, lambda: self.get_chatbot(chatbot_id))
+    
     async def update_chatbot(self, chatbot_id: str, chatbot_data: Dict[str, Any]) -> bool:
         """Update chatbot data in Firestore"""
         chatbot_ref = self.db.collection('chatbots').document(chatbot_id)
-        chatbot_ref.update({
+        await _run_blocking(chatbot_ref.update, {
             **chatbot_data,
             'updatedAt': firestore.SERVER_TIMESTAMP
         })
+        _chatbot_cache.invalidate(chatbot_id)
         return True
     
     async def delete_chatbot(self, chatbot_id: str) -> bool:
         """Delete chatbot from Firestore"""
         chatbot_ref = self.db.collection('chatbots').document(chatbot_id)
-        chatbot_ref.delete()
+        await _run_blocking(chatbot_ref.delete)
+        _chatbot_cache.invalidate(chatbot_id)
         return True
     
     async def list_chatbots(self, owner_id: str) -> List[Dict[str, Any]]:
         """List all chatbots for a user"""
-        chatbots = self.db.collection('chatbots').where('ownerId', '==', owner_id).stream()
+        chatbots = await _run_blocking(lambda: list(self.db.collection('chatbots').where('ownerId', '==', owner_id).stream()))
         return [chatbot.to_dict() for chatbot in chatbots]
     
+    async def list_chatbot_ids_referencing(self, owner_id: str, document_id: str) -> List[str]:
+        """List the IDs of a user's chatbots that include a document
+        
+        Args:
+            owner_id: ID of the chatbots' owner
+            document_id: Document ID to look for in each chatbot's documents
+            
+        Returns:
+            Chatbot IDs
+        """
+        query = (
+            self.db.collection('chatbots')
+            .where('ownerId', '==', owner_id)
+            .where('documents', 'array_contains', document_id)
+            .select([])
+        )
+        chatbots = await _run_blocking(lambda: list(query.stream()))
+        return [chatbot.id for chatbot in chatbots]
+    
     # Document operations
     async def create_document(self, data: Dict[str, Any]) -> str:
         """Create a new document in Firestore, using provided ID if available."""
         try:
             # Add timestamps if not already present (though API layer adds them)
             if 'createdAt' not in data:
-                data['createdAt'] = datetime.utcnow().isoformat()
+                data['createdAt'] = datetime.now(timezone.utc)
             if 'updatedAt' not in data:
-                data['updatedAt'] = datetime.utcnow().isoformat()
+                data['updatedAt'] = datetime.now(timezone.utc)
             
             document_id = data.get('id')
 
@@ -152,8 +381,9 @@ class FirestoreDB:
                 document_id = doc_ref.id
                 data['id'] = document_id # Ensure ID is in the data being set
 
-            # Set the data in Firestore
-            doc_ref.set(data, merge=True) # Use merge=True to avoid overwriting existing fields if re-uploading?
+            # Set the data in Firestore, sharing a commit with any concurrent writes
+            await self.writer.set(doc_ref, data, merge=True) # Use merge=True to avoid overwriting existing fields if re-uploading?
+            _document_cache.invalidate(document_id)
             
             # Return the document ID used
             return document_id
@@ -166,7 +396,7 @@ class FirestoreDB:
         """Get a document by ID"""
         try:
             doc_ref = self.db.collection('documents').document(document_id)
-            doc = doc_ref.get()
+            doc = await _run_blocking(doc_ref.get)
             if doc.exists:
                 return doc.to_dict()
             return None
@@ -174,37 +404,230 @@ class FirestoreDB:
             logger.error(f"Error getting document from Firestore: {str(e)}")
             raise
     
+    async def get_document_cached(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """Get a document by ID, served from a short-lived in-process cache"""
+        document = _document_cache.get(document_id)
+        if document is not None:
+            logger.debug("Document cache hit: %s", document_id)
+            return document
+        logger.debug("Document cache miss: %s", document_id)
+        return await _document_cache.get_or_fetch(document_id, lambda: self.get_document(document_id))
+    
+    async def get_owned_document(self, document_id: str, owner_id: str) -> Optional[Dict[str, Any]]:
+        """Get a document only if it belongs to the given owner
+        
+        The ownership filter is part of the query, so documents owned by
+        someone else are never sent back from Firestore.
+        
+        Args:
+            document_id: The ID of the document
+            owner_id: The ID of the expected owner
+            
+        Returns:
+            Document data, or None if it does not exist or is not owned by owner_id
+        """
+        document = _document_cache.get(document_id)
+        if document is not None:
+            logger.debug("Document cache hit: %s", document_id)
+            return document if document.get('ownerId') == owner_id else None
+        
+        try:
+            documents_ref = self.db.collection('documents')
+            query = (
+                documents_ref
+                .where(FieldPath.document_id(), '==', documents_ref.document(document_id))
+                .where('ownerId', '==', owner_id)
+                .limit(1)
+            )
+            docs = await _run_blocking(lambda: list(query.stream()))
+            if not docs:
+                return None
+            document = docs[0].to_dict()
+            _document_cache.set(document_id, document)
+            return document
+        except Exception as e:
+            logger.error(f"Error getting document from Firestore: {str(e)}")
+            raise
+    
+    async def get_documents_bulk(self, document_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Get several documents in batched reads
+        
+        Args:
+            document_ids: IDs of the documents to fetch
+            
+        Returns:
+            Dict of document ID to document data. Missing documents are omitted.
+        """
+        try:
+            documents = {}
+            unique_ids = list(dict.fromkeys(document_ids))
+            for i in range(0, len(unique_ids), 500):
+                refs = [self.db.collection('documents').document(doc_id) for doc_id in unique_ids[i:i + 500]]
+                snapshots = await _run_blocking(lambda: list(self.db.get_all(refs)))
+                documents.update({snap.id: snap.to_dict() for snap in snapshots if snap.exists})
+            return documents
+        except Exception as e:
+            logger.error(f"Error getting documents from Firestore: {str(e)}")
+            raise
+    
     async def update_document(self, document_id: str, data: Dict[str, Any]) -> None:
         """Update a document by ID"""
         try:
-            data['updatedAt'] = datetime.utcnow().isoformat()
+            data['updatedAt'] = datetime.now(timezone.utc)
             doc_ref = self.db.collection('documents').document(document_id)
-            doc_ref.update(data)
+            await _run_blocking(doc_ref.update, data)
+            _document_cache.invalidate(document_id)
         except Exception as e:
             logger.error(f"Error updating document in Firestore: {str(e)}")
             raise
     
+    async def claim_document(
+        self,
+        document_id: str,
+        from_statuses: tuple,
+        data: Dict[str, Any],
+        stale_statuses: tuple = (),
+        stale_after: Optional[float] = None
+    ) -> bool:
+        """Update a document only if its processingStatus is one of from_statuses
+        
+        The check and the write run in one transaction, so when several
+        workers race for the same document exactly one of them wins.
+        
+        Args:
+            document_id: ID of the document
+            from_statuses: processingStatus values the document may be in
+            data: Fields to write, typically including the new processingStatus
+            stale_statuses: processingStatus values the document may also be
+                in, provided it was last updated more than stale_after
+                seconds ago
+            stale_after: Age in seconds after which a document in one of
+                stale_statuses counts as stuck
+            
+        Returns:
+            True if the update was applied, False if the document is missing
+            or in another status
+        """
+        doc_ref = self.db.collection('documents').document(document_id)
+        transaction = self.db.transaction()
+        
+        @firestore.transactional
+        def claim(transaction) -> bool:
+            snapshot = doc_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return False
+            current = snapshot.to_dict() or {}
+            status = current.get('processingStatus')
+            if status not in from_statuses and not (
+                status in stale_statuses and _is_stale(current.get('updatedAt'), stale_after)
+            ):
+                return False
+            transaction.update(doc_ref, {**data, 'updatedAt': datetime.now(timezone.utc)})
+            return True
+        
+        claimed = await _run_blocking(claim, transaction)
+        if claimed:
+            _document_cache.invalidate(document_id)
+        return claimed
+    
+    async def list_unfinished_document_ids(self, stale_after: float) -> List[str]:
+        """List the IDs of documents whose processing job may have been lost
+        
+        Args:
+            stale_after: Age in seconds after which a processing document
+                counts as stuck
+            
+        Returns:
+            IDs of all pending documents and of processing documents last
+            updated more than stale_after seconds ago
+        """
+        documents_ref = self.db.collection('documents')
+        pending_query = documents_ref.where('processingStatus', '==', 'pending').select([])
+        # Filter processing documents by age here rather than in the query,
+        # which would need a composite index; there are only ever a few
+        processing_query = documents_ref.where('processingStatus', '==', 'processing').select(['updatedAt'])
+        pending, processing = await asyncio.gather(
+            _run_blocking(lambda: list(pending_query.stream())),
+            _run_blocking(lambda: list(processing_query.stream()))
+        )
+        stale = [
+            doc for doc in processing
+            if _is_stale((doc.to_dict() or {}).get('updatedAt'), stale_after)
+        ]
+        return [doc.id for doc in pending + stale]
+    
     async def delete_document(self, document_id: str) -> None:
         """Delete a document by ID"""
         try:
             doc_ref = self.db.collection('documents').document(document_id)
-            doc_ref.delete()
+            await _run_blocking(doc_ref.delete)
+            _document_cache.invalidate(document_id)
         except Exception as e:
             logger.error(f"Error deleting document from Firestore: {str(e)}")
             raise
     
-    async def list_documents(self, owner_id: str) -> list[Dict[str, Any]]:
-        """List all documents for a specific owner
+    async def delete_document_and_unlink(self, document_id: str, chatbot_ids: List[str]) -> None:
+        """Delete a document and remove it from chatbots in batched writes
+        
+        Args:
+            document_id: ID of the document to delete
+            chatbot_ids: IDs of the chatbots that reference the document
+        """
+        writes = [
+            (self.db.collection('chatbots').document(chatbot_id), {
+                'documents': firestore.ArrayRemove([document_id]),
+                'updatedAt': firestore.SERVER_TIMESTAMP
+            })
+            for chatbot_id in chatbot_ids
+        ]
+        # None marks the document delete, committed with the last batch
+        writes.append((self.db.collection('documents').document(document_id), None))
+        
+        for i in range(0, len(writes), 500):
+            batch = self.batch()
+            for ref, data in writes[i:i + 500]:
+                if data is None:
+                    batch.delete(ref)
+                else:
+                    batch.update(ref, data)
+            await _run_blocking(batch.commit)
+        
+        _document_cache.invalidate(document_id)
+        for chatbot_id in chatbot_ids:
+            _chatbot_cache.invalidate(chatbot_id)
+    
+    async def list_documents(
+        self,
+        owner_id: str,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        fields: Optional[List[str]] = None
+    ) -> list[Dict[str, Any]]:
+        """List documents for a specific owner, ordered by document ID
         
         Args:
             owner_id: The ID of the document owner
+            limit: Maximum number of documents to return, or None for all
+            cursor: ID of the last document of the previous page, if any
+            fields: Fields to fetch, or None for the whole document
             
         Returns:
             List of documents owned by the user
         """
         try:
-            docs = self.db.collection('documents').where('ownerId', '==', owner_id).stream()
-            return [doc.to_dict() for doc in docs]
+            documents_ref = self.db.collection('documents')
+            query = documents_ref.where('ownerId', '==', owner_id).order_by('__name__')
+            if fields:
+                query = query.select(fields)
+            if cursor:
+                cursor_doc = await _run_blocking(documents_ref.document(cursor).get)
+                if not cursor_doc.exists:
+                    return []
+                query = query.start_after(cursor_doc)
+            if limit:
+                query = query.limit(limit)
+            docs = await _run_blocking(lambda: list(query.stream()))
+            return [{**doc.to_dict(), 'id': doc.id} for doc in docs]
         except Exception as e:
             logger.error(f"Error listing documents from Firestore: {str(e)}")
             raise
@@ -214,7 +637,7 @@ class FirestoreDB:
         """Create a new chat session in Firestore"""
         session_ref = self.db.collection('chatSessions').document()
         session_id = session_ref.id
-        session_ref.set({
+        await _run_blocking(session_ref.set, {
             **session_data,
             'id': session_id,
             'createdAt': firestore.SERVER_TIMESTAMP,
@@ -223,10 +646,28 @@ class FirestoreDB:
         })
         return session_id
     
+    @firestore_retry
     async def get_chat_session(self, session_id: str) -> Optional[Dict[str, Any]]:
         """Get chat session data from Firestore"""
         session_ref = self.db.collection('chatSessions').document(session_id)
-        session = session_ref.get()
+        session = await _run_blocking(session_ref.get)
+        if session.exists:
+            return session.to_dict()
+        return None
+    
+    @firestore_retry
+    async def get_chat_session_meta(self, session_id: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """Get selected fields of a chat session without its message history
+        
+        Args:
+            session_id: The ID of the chat session
+            fields: Fields to read, defaults to userId, chatbotId and updatedAt
+            
+        Returns:
+            Dict with the requested fields, or None if the session doesn't exist
+        """
+        session_ref = self.db.collection('chatSessions').document(session_id)
+        session = await _run_blocking(session_ref.get, field_paths=fields or ['userId', 'chatbotId', 'updatedAt'])
         if session.exists:
             return session.to_dict()
         return None
@@ -234,7 +675,7 @@ class FirestoreDB:
     async def add_chat_message(self, session_id: str, message: Dict[str, Any]) -> bool:
         """Add a message to a chat session"""
         session_ref = self.db.collection('chatSessions').document(session_id)
-        session_ref.update({
+        await _run_blocking(session_ref.update, {
             'messages': firestore.ArrayUnion([{
                 **message,
                 'timestamp': firestore.SERVER_TIMESTAMP
@@ -243,29 +684,169 @@ class FirestoreDB:
         })
         return True
     
-    async def list_chat_sessions(self, user_id: str) -> List[Dict[str, Any]]:
-        """List all chat sessions for a user"""
-        sessions = self.db.collection('chatSessions').where('userId', '==', user_id).stream()
+    def _messages_ref(self, session_id: str):
+        """Get the messages subcollection of a chat session"""
+        return self.db.collection('chatSessions').document(session_id).collection('messages')
+    
+    @firestore_retry
+    async def add_message(self, session_id: str, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Add a single message to a chat session's messages subcollection
+        
+        Args:
+            session_id: The ID of the chat session
+            message: Message data. A server timestamp is used if none is given,
+                and an ID is generated unless one is given.
+            
+        Returns:
+            The stored message including its ID
+        """
+        message_ref = self._messages_ref(session_id).document(message.get('id'))
+        stored = {
+            'timestamp': firestore.SERVER_TIMESTAMP,
+            **message,
+            'id': message_ref.id
+        }
+        await _run_blocking(message_ref.set, stored)
+        await _run_blocking(self.db.collection('chatSessions').document(session_id).update, {
+            'updatedAt': firestore.SERVER_TIMESTAMP
+        })
+        return stored
+    
+    @firestore_retry
+    async def append_messages(self, session_id: str, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Append messages to a chat session in a single batched write
+        
+        Args:
+            session_id: The ID of the chat session
+            messages: Messages to append, in order. Each needs a concrete
+                timestamp so the order is preserved when listing.
+            
+        Returns:
+            The stored messages including their generated IDs
+        """
+        batch = self.db.batch()
+        messages_ref = self._messages_ref(session_id)
+        stored = []
+        for message in messages:
+            message_ref = messages_ref.document()
+            data = {**message, 'id': message_ref.id}
+            batch.set(message_ref, data)
+            stored.append(data)
+        batch.update(self.db.collection('chatSessions').document(session_id), {
+            'updatedAt': firestore.SERVER_TIMESTAMP
+        })
+        await _run_blocking(batch.commit)
+        return stored
+    
+    @firestore_retry
+    async def list_messages(self, session_id: str, limit: int = 50, before: Optional[str] = None) -> List[Dict[str, Any]]:
+        """List a page of messages for a chat session, oldest first
+        
+        Args:
+            session_id: The ID of the chat session
+            limit: Maximum number of messages to return
+            before: ID of the last message of the previous page, if any
+            
+        Returns:
+            List of messages
+        """
+        messages_ref = self._messages_ref(session_id)
+        query = messages_ref.order_by('timestamp')
+        if before:
+            cursor = await _run_blocking(messages_ref.document(before).get)
+            if not cursor.exists:
+                return []
+            query = query.start_after(cursor)
+        docs = await _run_blocking(lambda: list(query.limit(limit).stream()))
+        return [doc.to_dict() for doc in docs]
+    
+    async def list_chat_sessions(self, user_id: str, limit: Optional[int] = None, cursor: Optional[str] = None) -> List[Dict[str, Any]]:
+        """List a user's chat sessions, most recently updated first
+        
+        Uses the (userId, updatedAt desc) composite index from
+        firestore.indexes.json.
+        
+        Args:
+            user_id: The ID of the user
+            limit: Maximum number of sessions to return, or None for all
+            cursor: ID of the last session of the previous page, if any
+            
+        Returns:
+            List of chat sessions
+        """
+        sessions_ref = self.db.collection('chatSessions')
+        query = sessions_ref.where('userId', '==', user_id).order_by('updatedAt', direction=firestore.Query.DESCENDING)
+        if cursor:
+            cursor_doc = await _run_blocking(sessions_ref.document(cursor).get)
+            if not cursor_doc.exists:
+                return []
+            query = query.start_after(cursor_doc)
+        if limit:
+            query = query.limit(limit)
+        sessions = await _run_blocking(lambda: list(query.stream()))
         return [session.to_dict() for session in sessions]
     
     async def list_chat_sessions_by_chatbot(self, chatbot_id: str) -> List[Dict[str, Any]]:
         """List all chat sessions for a specific chatbot"""
-        sessions = self.db.collection('chatSessions').where('chatbotId', '==', chatbot_id).stream()
+        sessions = await _run_blocking(lambda: list(self.db.collection('chatSessions').where('chatbotId', '==', chatbot_id).stream()))
         return [session.to_dict() for session in sessions]
     
     async def delete_chat_session(self, session_id: str) -> bool:
-        """Delete a chat session"""
+        """Delete a chat session document
+        
+        The messages subcollection is not removed with its parent; use
+        delete_messages_subcollection for that.
+        """
         session_ref = self.db.collection('chatSessions').document(session_id)
-        session_ref.delete()
+        await _run_blocking(session_ref.delete)
         return True
     
+    async def delete_chat_sessions_bulk(self, session_ids: List[str]) -> int:
+        """Delete several chat session documents with batched writes
+        
+        Like delete_chat_session, this leaves the messages subcollections.
+        
+        Args:
+            session_ids: IDs of the chat sessions to delete
+            
+        Returns:
+            Number of sessions deleted
+        """
+        for i in range(0, len(session_ids), 500):
+            batch = self.batch()
+            for session_id in session_ids[i:i + 500]:
+                batch.delete(self.db.collection('chatSessions').document(session_id))
+            await _run_blocking(batch.commit)
+        return len(session_ids)
+    
+    async def delete_messages_subcollection(self, session_id: str) -> int:
+        """Delete every message stored under a chat session
+        
+        Args:
+            session_id: The ID of the chat session
+            
+        Returns:
+            Number of messages deleted
+        """
+        deleted = 0
+        while True:
+            docs = await _run_blocking(lambda: list(self._messages_ref(session_id).limit(500).stream()))
+            if not docs:
+                break
+            batch = self.db.batch()
+            for doc in docs:
+                batch.delete(doc.reference)
+            await _run_blocking(batch.commit)
+            deleted += len(docs)
+        return deleted
+    
     # Integration methods
     async def list_integrations(self, user_id):
         """List all integrations for a user"""
         try:
             integrations_ref = self.db.collection("integrations")
             query = integrations_ref.where("userId", "==", user_id)
-            integrations_docs = query.stream()
+            integrations_docs = await _run_blocking(lambda: list(query.stream()))
             
             integrations = []
             for doc in integrations_docs:
@@ -278,6 +859,13 @@ class FirestoreDB:
             logger.error(traceback.format_exc())
             raise e
     
+    async def list_integrations_cached(self, user_id: str) -> List[Dict[str, Any]]:
+        """List a user's integrations, served from a short-lived in-process cache
+        
+        The cached list is shared, so callers must not mutate it.
+        """
+        return await _integration_list_cache.get_or_fetch(user_id, lambda: self.list_integrations(user_id))
+    
     async def create_integration(self, integration_data):
         """Create a new integration"""
         try:
@@ -286,7 +874,8 @@ class FirestoreDB:
                 raise ValueError("Integration ID is required")
                 
             integration_ref = self.db.collection("integrations").document(integration_id)
-            integration_ref.set(integration_data)
+            await _run_blocking(integration_ref.set, integration_data)
+            _invalidate_integration(integration_id, integration_data.get("userId"))
             
             return integration_data
         except Exception as e:
@@ -298,7 +887,7 @@ class FirestoreDB:
         """Get an integration by ID"""
         try:
             integration_ref = self.db.collection("integrations").document(integration_id)
-            integration_doc = integration_ref.get()
+            integration_doc = await _run_blocking(integration_ref.get)
             
             if not integration_doc.exists:
                 return None
@@ -309,11 +898,19 @@ class FirestoreDB:
             logger.error(traceback.format_exc())
             raise e
     
+    async def get_integration_cached(self, integration_id: str) -> Optional[Dict[str, Any]]:
+        """Get an integration, served from a short-lived in-process cache
+        
+        The cached dict is shared, so callers must not mutate it.
+        """
+        return await _integration_cache.get_or_fetch(integration_id, lambda: self.get_integration(integration_id))
+    
     async def update_integration(self, integration_id, update_data):
         """Update an integration"""
         try:
             integration_ref = self.db.collection("integrations").document(integration_id)
-            integration_ref.update(update_data)
+            await _run_blocking(integration_ref.update, update_data)
+            _invalidate_integration(integration_id, update_data.get("userId"))
             
             return True
         except Exception as e:
@@ -325,7 +922,8 @@ class FirestoreDB:
         """Delete an integration"""
         try:
             integration_ref = self.db.collection("integrations").document(integration_id)
-            integration_ref.delete()
+            await _run_blocking(integration_ref.delete)
+            _invalidate_integration(integration_id)
             
             return True
         except Exception as e:
@@ -338,7 +936,7 @@ class FirestoreDB:
         """Get user settings from Firestore"""
         try:
             settings_ref = self.db.collection("settings").document(user_id)
-            settings_doc = settings_ref.get()
+            settings_doc = await _run_blocking(settings_ref.get)
             
             if not settings_doc.exists:
                 return None
@@ -349,6 +947,41 @@ class FirestoreDB:
             logger.error(traceback.format_exc())
             raise e
     
+    async def get_or_create_user_settings(
+        self,
+        user_id: str,
+        default_factory: Callable[[], Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """Get user settings, creating the defaults if the user has none
+        
+        Served from a short-lived in-process cache. The defaults are written
+        with create(), which fails if the document already exists, so two
+        first requests racing each other can't both write defaults. The
+        loser reads back the winner's settings.
+        
+        Args:
+            user_id: The ID of the user
+            default_factory: Builds the default settings document
+            
+        Returns:
+            The user's settings. The cached dict is shared, so callers must
+            not mutate it.
+        """
+        async def load() -> Dict[str, Any]:
+            settings_data = await self.get_user_settings(user_id)
+            if settings_data:
+                return settings_data
+            
+            settings_data = default_factory()
+            settings_ref = self.db.collection("settings").document(user_id)
+            try:
+                await _run_blocking(settings_ref.create, settings_data)
+                return settings_data
+            except google_exceptions.Conflict:
+                return await self.get_user_settings(user_id)
+        
+        return await _user_settings_cache.get_or_fetch(user_id, load)
+    
     async def create_user_settings(self, settings_data):
         """Create user settings in Firestore"""
         try:
@@ -357,7 +990,8 @@ class FirestoreDB:
                 raise ValueError("User ID is required for settings")
                 
             settings_ref = self.db.collection("settings").document(user_id)
-            settings_ref.set(settings_data)
+            await _run_blocking(settings_ref.set, settings_data)
+            _user_settings_cache.invalidate(user_id)
             
             return settings_data
         except Exception as e:
@@ -369,7 +1003,8 @@ class FirestoreDB:
         """Update user settings in Firestore"""
         try:
             settings_ref = self.db.collection("settings").document(user_id)
-            settings_ref.update(update_data)
+            await _run_blocking(settings_ref.update, update_data)
+            _user_settings_cache.invalidate(user_id)
             
             return True
         except Exception as e:
@@ -377,12 +1012,20 @@ class FirestoreDB:
             logger.error(traceback.format_exc())
             raise e
 
-    async def list_integrations_by_query(self, field_path: str, op_string: str, value: Any) -> List[Dict[str, Any]]:
+    async def list_integrations_by_query(
+        self,
+        field_path: str,
+        op_string: str,
+        value: Any,
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
         """List integrations by a specific query"""
         try:
             integrations_ref = self.db.collection("integrations")
             query = integrations_ref.where(field_path, op_string, value)
-            integrations_docs = query.stream()
+            if limit:
+                query = query.limit(limit)
+            integrations_docs = await _run_blocking(lambda: list(query.stream()))
             
             integrations = []
             for doc in integrations_docs:
@@ -404,7 +1047,7 @@ class FirestoreDB:
         try:
             # Get all documents
             documents_ref = self.db.collection('documents')
-            docs = await documents_ref.get()
+            docs = await _run_blocking(documents_ref.get)
             
             # Count by status
             status_counts = {
@@ -458,84 +1101,86 @@ class FirebaseStorage:
         self.logger = logging.getLogger(__name__)
     
     async def upload_file(self, file: UploadFile, document_id: str, user_id: str) -> int:
-        """Upload a file to Firebase Storage"""
-        temp_file = None
+        """Upload a file to Firebase Storage
+        
+        The upload body is streamed from the request's spooled temporary file
+        in UPLOAD_CHUNK_SIZE pieces rather than read into memory.
+        
+        Raises:
+            HTTPException: 413 if the file exceeds MAX_UPLOAD_SIZE
+        """
         try:
             self.logger.info(f"Starting Firebase upload for user {user_id}")
             
             # Validate file
             if not file or not file.filename:
                 raise ValueError("No file provided")
+            
+            # Measure the file without reading it
+            file.file.seek(0, os.SEEK_END)
+            file_size = file.file.tell()
+            file.file.seek(0)
+            self.logger.info(f"File size: {file_size} bytes")
+            
+            if file_size > settings.MAX_UPLOAD_SIZE:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"File exceeds the maximum upload size of {settings.MAX_UPLOAD_SIZE} bytes"
+                )
                 
             # Create the storage path
             storage_path = f"documents/{user_id}/{document_id}/{file.filename}"
             self.logger.info(f"Storage path: {storage_path}")
             
-            # Read file content first
-            content = await file.read()
-            file_size = len(content)
-            self.logger.info(f"Read file content, size: {file_size} bytes")
-            
-            # Create a temporary file
-            temp_file = tempfile.NamedTemporaryFile(delete=False)
-            temp_file_path = temp_file.name
-            self.logger.info(f"Created temporary file: {temp_file_path}")
-            
-            # Write content to temp file
-            temp_file.write(content)
-            temp_file.flush()
-            temp_file.close()  # Close the file handle explicitly
+            # Create blob and stream the upload in chunks
+            blob = self.bucket.blob(storage_path, chunk_size=UPLOAD_CHUNK_SIZE)
+            await _run_blocking(
+                blob.upload_from_file,
+                file.file,
+                size=file_size,
+                content_type=file.content_type
+            )
+            self.logger.info("Upload completed")
             
-            try:
-                # Create blob and upload
-                blob = self.bucket.blob(storage_path)
-                self.logger.info("Created blob reference")
-                
-                # Upload the file
-                blob.upload_from_filename(
-                    temp_file_path,
-                    content_type=file.content_type
-                )
-                self.logger.info("Upload completed")
-                
-                # Make the file publicly accessible
-                blob.make_public()
-                self.logger.info(f"File is now public at: {blob.public_url}")
-                
-            finally:
-                # Clean up temp file
-                try:
-                    if os.path.exists(temp_file_path):
-                        os.unlink(temp_file_path)
-                        self.logger.info("Temporary file cleaned up")
-                except Exception as cleanup_error:
-                    self.logger.warning(f"Failed to clean up temporary file: {cleanup_error}")
+            # Make the file publicly accessible
+            await _run_blocking(blob.make_public)
+            self.logger.info(f"File is now public at: {blob.public_url}")
             
             # Reset file pointer for potential future reads
             await file.seek(0)
             
             return file_size
             
+        except HTTPException:
+            raise
         except Exception as e:
             self.logger.error(f"Firebase upload failed: {str(e)}")
-            # Attempt final cleanup if temp file exists
-            if temp_file:
-                try:
-                    temp_file_path = temp_file.name
-                    if os.path.exists(temp_file_path):
-                        os.unlink(temp_file_path)
-                except Exception:
-                    pass  # Ignore cleanup errors in error handler
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed to upload file to Firebase Storage: {str(e)}"
             )
     
+    async def upload_bytes(self, data: bytes, storage_path: str, content_type: str = "text/plain; charset=utf-8") -> int:
+        """Upload in-memory content to Firebase Storage
+        
+        Args:
+            data: Content to store
+            storage_path: Destination path in the bucket
+            content_type: MIME type of the content
+            
+        Returns:
+            Number of bytes uploaded
+        """
+        blob = self.bucket.blob(storage_path)
+        await _run_blocking(blob.upload_from_string, data, content_type=content_type)
+        self.logger.info(f"Uploaded {len(data)} bytes to {storage_path}")
+        return len(data)
+    
     async def download_file(self, source_path: str) -> str:
         """Download a file from Firebase Storage, preserving the extension."""
         try:
             blob = self.bucket.blob(source_path)
-            if not blob.exists():
+            if not await _run_blocking(blob.exists):
                  logger.error(f"Blob does not exist at source path: {source_path}")
                  raise FileNotFoundError(f"File not found in storage at {source_path}")
             
@@ -547,7 +1192,7 @@ class FirebaseStorage:
             # Create a named temporary file with the correct suffix (extension)
             with tempfile.NamedTemporaryFile(delete=False, suffix=extension) as temp_file:
                 logger.info(f"Downloading to temporary file: {temp_file.name}")
-                blob.download_to_filename(temp_file.name)
+                await _run_blocking(blob.download_to_filename, temp_file.name)
                 logger.info(f"Download complete for {source_path}")
                 return temp_file.name
         except Exception as e:
@@ -557,7 +1202,7 @@ class FirebaseStorage:
     async def delete_file(self, file_path: str) -> bool:
         """Delete a file from Firebase Storage"""
         blob = self.bucket.blob(file_path)
-        blob.delete()
+        await _run_blocking(blob.delete)
         return True
 
 # Firebase Authentication operations
@@ -594,6 +1239,11 @@ class FirebaseAuth:
             'displayName': user.display_name
         }
     
+    async def create_custom_token(self, uid: str) -> str:
+        """Create a custom token for a user"""
+        token = await _run_blocking(auth.create_custom_token, uid)
+        return token.decode('utf-8') if isinstance(token, bytes) else token
+    
     async def get_user(self, uid: str) -> Dict[str, Any]:
         """Get user data from Firebase Authentication"""
         user = auth.get_user(uid)
@@ -621,10 +1271,25 @@ class FirebaseAuth:
         auth.delete_user(uid)
         return True
 
+@functools.lru_cache(maxsize=1)
+def get_firestore_db() -> FirestoreDB:
+    """Get the process-wide FirestoreDB instance"""
+    return FirestoreDB()
+
+@functools.lru_cache(maxsize=1)
+def get_firebase_storage() -> FirebaseStorage:
+    """Get the process-wide FirebaseStorage instance"""
+    return FirebaseStorage()
+
+@functools.lru_cache(maxsize=1)
+def get_firebase_auth() -> FirebaseAuth:
+    """Get the process-wide FirebaseAuth instance"""
+    return FirebaseAuth()
+
 # Create instances to be imported by other modules
-firestore_db = FirestoreDB()
-storage = FirebaseStorage()
-firebase_auth = FirebaseAuth()
+firestore_db = get_firestore_db()
+storage = get_firebase_storage()
+firebase_auth = get_firebase_auth()
 
 # Export the instances
-__all__ = ['firestore_db', 'storage', 'firebase_auth']
\ No newline at end of file
+__all__ = ['firestore_db', 'get_firestore_db', 'build_default_settings', 'storage', 'get_firebase_storage', 'firebase_auth', 'get_firebase_auth']
\ No newline at end of file
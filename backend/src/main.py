@@ -1,9 +1,10 @@
 from fastapi import FastAPI, Depends, HTTPException, status, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 import uvicorn
 import os
+import asyncio
 from dotenv import load_dotenv
 import logging
 from datetime import datetime
@@ -18,6 +19,11 @@ from .api import (
     diagnostics,
     settings
 )
+from .services.llm import close_llm_clients
+from .services.integrations import close_http_session
+from .tasks.document_tasks import task_queue, reindex_queue
+from .services.document_processor import shutdown_parse_executor
+from contextlib import asynccontextmanager
 import argparse
 import traceback
 
@@ -28,11 +34,36 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm shared clients on startup and release them on shutdown"""
+    warmups = {
+        "firestore": chat.firestore_db.warm(),
+        "query_engine": chat.query_engine.warm()
+    }
+    results = await asyncio.gather(*warmups.values(), return_exceptions=True)
+    for name, result in zip(warmups, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Warmup of {name} failed: {str(result)}")
+    
+    task_queue.start()
+    reindex_queue.start()
+    
+    yield
+    
+    await task_queue.stop()
+    await reindex_queue.stop()
+    shutdown_parse_executor()
+    await close_llm_clients()
+    await close_http_session()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Chatbot Platform API",
     description="Backend API for the Chatbot Platform",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Debug middleware
@@ -85,7 +116,7 @@ async def health_check():
         # Return detailed health information
         return {
             "status": "ok",
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": datetime.now(),
             "services": {
                 "firebase": firebase_status,
                 "api": "running"
@@ -175,7 +206,7 @@ async def test_endpoint():
     """Simple test endpoint that doesn't require authentication"""
     return {
         "message": "API is working correctly",
-        "timestamp": datetime.now().isoformat()
+        "timestamp": datetime.now()
     }
 
 def main():
@@ -52,11 +52,6 @@ class Integration(IntegrationBase):
     """Complete integration model with ID"""
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
 
-    class Config:
-        json_encoders = {
-            datetime: lambda v: v.isoformat()
-        }
-
 class SlackIntegration(Integration):
     """Slack integration model"""
     type: Literal["slack"] = "slack"
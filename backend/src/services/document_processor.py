@@ -3,9 +3,11 @@ import uuid
 import tempfile
 import asyncio
 import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Dict, Any, Optional
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timezone
 
 from llama_index.core import SimpleDirectoryReader, Document
 from llama_index.core import VectorStoreIndex, StorageContext
@@ -14,11 +16,36 @@ from llama_index.vector_stores.milvus import MilvusVectorStore
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 
 from ..core.config import settings
-from ..db.firebase import FirestoreDB, FirebaseStorage
+from ..db.firebase import get_firestore_db, get_firebase_storage
 from ..db.vector_store import get_vector_db
 from ..utils.pdf_utils import extract_text_from_pdf
 from loguru import logger
 
+# PDF parsing is pure-Python CPU work that holds the GIL, so it runs in
+# worker processes where it can't starve the event loop. Spawned rather
+# than forked: forking after the gRPC clients start is unsafe.
+_parse_executor: Optional[ProcessPoolExecutor] = None
+
+def _get_parse_executor() -> ProcessPoolExecutor:
+    global _parse_executor
+    if _parse_executor is None:
+        _parse_executor = ProcessPoolExecutor(
+            max_workers=int(os.environ.get("PARSE_WORKERS", os.cpu_count() or 2)),
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _parse_executor
+
+def shutdown_parse_executor() -> None:
+    """Stop the PDF parsing worker processes"""
+    global _parse_executor
+    if _parse_executor is not None:
+        _parse_executor.shutdown(wait=False, cancel_futures=True)
+        _parse_executor = None
+
+def _read_text_file(file_path: str) -> str:
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+        return f.read()
+
 class ProcessingStep:
     """Enum for processing steps"""
     DOWNLOAD = "download"
@@ -37,8 +64,8 @@ class ProcessingStepStatus:
 
 class DocumentProcessor:
     def __init__(self):
-        self.firestore = FirestoreDB()
-        self.storage = FirebaseStorage()
+        self.firestore = get_firestore_db()
+        self.storage = get_firebase_storage()
         self.vector_db = get_vector_db()
         
         # Initialize embedding model - renamed from embed_model to embeddings
@@ -55,9 +82,9 @@ class DocumentProcessor:
         Returns:
             Dictionary with processing stats (chunk_count, download_time, processing_time, total_time)
         """
-        start_time = datetime.now()
+        start_time = datetime.now(timezone.utc)
         processing_stats = {
-            "startTime": start_time.isoformat(),
+            "startTime": start_time,
             "steps": {},
             "stepTimes": {}
         }
@@ -69,7 +96,7 @@ class DocumentProcessor:
                 document_id,
                 {
                     "processingStatus": "processing", 
-                    "updatedAt": datetime.utcnow().isoformat(),
+                    "updatedAt": datetime.now(timezone.utc),
                     "processingStats": processing_stats
                 }
             )
@@ -83,11 +110,13 @@ class DocumentProcessor:
             
             logger.info(f"Processing document: {document_id}")
             
-            # Prepare base metadata
+            # Prepare base metadata. Vector store metadata must be plain
+            # JSON, so timestamps are stored as ISO strings there.
+            created_at = document_data.get("createdAt") or datetime.now(timezone.utc)
             base_metadata = {
                 "document_id": document_id,
                 "name": document_data.get("name", "Untitled"),
-                "created_at": document_data.get("createdAt", datetime.utcnow().isoformat())
+                "created_at": created_at.isoformat() if isinstance(created_at, datetime) else created_at
             }
             
             # Check if this is a file or direct text
@@ -146,11 +175,11 @@ class DocumentProcessor:
                 return {"error": "No chunks created"}
             
             # Calculate processing time
-            end_time = datetime.now()
+            end_time = datetime.now(timezone.utc)
             total_time = (end_time - start_time).total_seconds()
             
             # Update final processing stats
-            processing_stats["endTime"] = end_time.isoformat()
+            processing_stats["endTime"] = end_time
             processing_stats["totalTime"] = total_time
             processing_stats["chunkCount"] = len(chunks)
             
@@ -160,7 +189,7 @@ class DocumentProcessor:
                 "chunkCount": len(chunks),
                 "vectorIds": [chunk['id'] for chunk in chunks],
                 "processingStats": processing_stats,
-                "updatedAt": datetime.utcnow().isoformat(),
+                "updatedAt": datetime.now(timezone.utc),
                 "error": None
             }
             
@@ -191,7 +220,7 @@ class DocumentProcessor:
                 
             processing_stats["steps"][step] = {
                 "status": status,
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": datetime.now(timezone.utc)
             }
             
             if error:
@@ -202,7 +231,7 @@ class DocumentProcessor:
                 document_id,
                 {
                     "processingStats": processing_stats,
-                    "updatedAt": datetime.utcnow().isoformat()
+                    "updatedAt": datetime.now(timezone.utc)
                 }
             )
         except Exception as e:
@@ -213,7 +242,7 @@ class DocumentProcessor:
         try:
             update_data = {
                 "processingStatus": status,
-                "updatedAt": datetime.utcnow().isoformat()
+                "updatedAt": datetime.now(timezone.utc)
             }
             
             if error:
@@ -257,7 +286,8 @@ class DocumentProcessor:
                     
                     # Process PDF
                     if file_ext == '.pdf':
-                        text = await asyncio.to_thread(extract_text_from_pdf, file_path)
+                        loop = asyncio.get_running_loop()
+                        text = await loop.run_in_executor(_get_parse_executor(), extract_text_from_pdf, file_path)
                         if not text:
                             logger.warning(f"PDF extraction returned empty text for {document_id}")
                             await self._update_processing_status(document_id, current_step, ProcessingStepStatus.FAILED, processing_stats, "PDF extraction failed - empty result")
@@ -267,8 +297,7 @@ class DocumentProcessor:
                         
                     # Process TXT
                     elif file_ext == '.txt':
-                        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
-                            text = f.read()
+                        text = await asyncio.to_thread(_read_text_file, file_path)
                         if not text:
                             logger.warning(f"Text file is empty for {document_id}")
                             await self._update_processing_status(document_id, current_step, ProcessingStepStatus.FAILED, processing_stats, "Text file is empty")
@@ -462,7 +491,7 @@ class DocumentProcessor:
         # Process document again
         return await self.process_document(document_id)
 
-    async def process_document_immediately(self, document_id: str, max_retries: int = 3) -> bool:
+    async def process_document_immediately(self, document_id: str, max_retries: int = 3) -> Optional[Dict[str, Any]]:
         """Process a document from Firebase Storage and store its embeddings
         
         Args:
@@ -470,7 +499,7 @@ class DocumentProcessor:
             max_retries: Maximum number of retries for fetching document
             
         Returns:
-            True if successful
+            The document as stored after processing completed
         """
         start_time = datetime.now()
         logger.info(f"Starting document processing at {start_time}")
@@ -527,12 +556,12 @@ class DocumentProcessor:
                 update_data = {
                     'processingStatus': 'completed',
                     'chunkCount': len(chunks),
-                    'updatedAt': datetime.now().isoformat(),
+                    'updatedAt': datetime.now(timezone.utc),
                     'processingStats': {
                         'downloadTime': download_time,
                         'processTime': process_time,
                         'totalChunks': len(chunks),
-                        'completedAt': datetime.now().isoformat()
+                        'completedAt': datetime.now(timezone.utc)
                     }
                 }
                 
@@ -552,7 +581,7 @@ class DocumentProcessor:
                 logger.info(f"Document processing completed successfully in {total_time:.2f} seconds")
                 logger.info(f"Stats: Download={download_time:.2f}s, Process={process_time:.2f}s, Chunks={len(chunks)}")
                 
-                return True
+                return {**document_data, **update_data}
                 
             except Exception as e:
                 if attempt < max_retries - 1:
@@ -569,9 +598,9 @@ class DocumentProcessor:
                     await self.firestore.update_document(document_id, {
                         'processingStatus': 'failed',
                         'error': error_msg,
-                        'errorTimestamp': datetime.now().isoformat(),
+                        'errorTimestamp': datetime.now(timezone.utc),
                         'processingStats': {
-                            'failedAt': datetime.now().isoformat(),
+                            'failedAt': datetime.now(timezone.utc),
                             'totalAttempts': attempt + 1,
                             'errorMessage': str(e)
                         }
@@ -580,4 +609,4 @@ class DocumentProcessor:
                     logger.error(f"Failed to update error status: {str(update_error)}")
                 raise
         
-        return False
\ No newline at end of file
+        return None
\ No newline at end of file
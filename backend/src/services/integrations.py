@@ -1,4 +1,7 @@
 import aiohttp
+from cachetools import LRUCache
+import hashlib
+import hmac
 import logging
 import json
 from typing import Dict, Any, Optional
@@ -7,51 +10,94 @@ import uuid
 
 logger = logging.getLogger(__name__)
 
+# One pooled HTTP session shared by every integration handler, so Slack,
+# Discord and website checks reuse connections instead of redoing TCP/TLS
+# setup per call. Created lazily because it must be bound to the running loop.
+_http_session: Optional[aiohttp.ClientSession] = None
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """Get the shared aiohttp session, creating it if needed"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, keepalive_timeout=60)
+        )
+    return _http_session
+
+async def close_http_session():
+    """Close the shared aiohttp session on shutdown"""
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+
+class SlackBotClient:
+    """Slack credentials for one integration, in the form requests need them"""
+    
+    def __init__(self, bot_token: str, signing_secret: str):
+        self.bot_token = bot_token
+        self.signing_secret = signing_secret
+        self.signing_secret_bytes = signing_secret.encode('utf-8')
+        self.headers = {
+            "Authorization": f"Bearer {bot_token}",
+            "Content-Type": "application/json"
+        }
+
 class SlackIntegrationHandler:
     """Handler for Slack integrations"""
     
     def __init__(self):
-        self.session = None
-        self._bot_token = None
-        self._signing_secret = None
-        self._chatbot_settings = None
+        # Per-integration clients, so events don't rebuild them every time
+        self._clients = LRUCache(maxsize=1024)
     
     async def _get_session(self) -> aiohttp.ClientSession:
-        """Get or create an aiohttp session"""
-        if self.session is None or self.session.closed:
-            self.session = aiohttp.ClientSession()
-        return self.session
-    
-    def set_credentials(self, bot_token: str, signing_secret: str, chatbot_settings: Optional[Dict[str, Any]] = None):
-        """Set bot credentials and chatbot settings"""
-        self._bot_token = bot_token
-        self._signing_secret = signing_secret
-        self._chatbot_settings = chatbot_settings
+        """Get the shared aiohttp session"""
+        return await get_http_session()
     
-    async def verify_request_signature(self, timestamp: str, signature: str, body: str) -> bool:
-        """Verify Slack request signature"""
-        if not self._signing_secret:
-            logger.error("Signing secret not configured")
-            return False
+    def get_client(self, integration_id: str, bot_token: str, signing_secret: str) -> SlackBotClient:
+        """Get the cached client for an integration, rebuilding it if the credentials changed
+        
+        Args:
+            integration_id: ID of the Slack integration
+            bot_token: Bot token from the integration config
+            signing_secret: Signing secret from the integration config
             
+        Returns:
+            Client holding the precomputed auth headers and signing key
+        """
+        client = self._clients.get(integration_id)
+        if client is None or client.bot_token != bot_token or client.signing_secret != signing_secret:
+            client = SlackBotClient(bot_token, signing_secret)
+            self._clients[integration_id] = client
+        return client
+    
+    def invalidate_client(self, integration_id: str) -> None:
+        """Drop the cached client for an integration"""
+        self._clients.pop(integration_id, None)
+    
+    async def verify_request_signature(self, client: SlackBotClient, timestamp: str, signature: str, body: bytes) -> bool:
+        """Verify Slack request signature over the raw request body"""
         # Create base string
-        base_string = f"v0:{timestamp}:{body}"
+        signature_bytes = b"v0:" + timestamp.encode('utf-8') + b":" + body
         
         # Create signature
-        signature_bytes = base_string.encode('utf-8')
-        slack_signing_secret = self._signing_secret.encode('utf-8')
-        
-        import hmac
-        import hashlib
+        slack_signing_secret = client.signing_secret_bytes
         
-        # Calculate expected signature
-        hex_hash = hmac.new(slack_signing_secret, signature_bytes, hashlib.sha256).hexdigest()
-        calculated_signature = f"v0={hex_hash}"
+        # Calculate expected signature and compare as bytes, which also
+        # copes with non-ASCII header values
+        calculated_signature = b"v0=" + hmac.new(slack_signing_secret, signature_bytes, hashlib.sha256).hexdigest().encode('ascii')
         
-        return hmac.compare_digest(calculated_signature, signature)
+        return hmac.compare_digest(calculated_signature, signature.encode('utf-8'))
     
-    async def handle_event(self, event_data: dict) -> Optional[dict]:
-        """Handle Slack events"""
+    async def handle_event(
+        self,
+        event_data: dict,
+        client: SlackBotClient,
+        chatbot_settings: Optional[Dict[str, Any]] = None
+    ) -> Optional[dict]:
+        """Handle Slack events
+        
+        The client and chatbot settings are passed per call rather than kept
+        on the handler, since the handler is shared by concurrent requests.
+        """
         try:
             event_type = event_data.get("type")
             
@@ -64,7 +110,7 @@ class SlackIntegrationHandler:
                 
                 if event.get("type") == "message" and not event.get("bot_id"):
                     # Handle user message
-                    return await self._handle_message_event(event)
+                    return await self._handle_message_event(event, client, chatbot_settings)
                     
             return None
             
@@ -72,7 +118,12 @@ class SlackIntegrationHandler:
             logger.error(f"Error handling Slack event: {str(e)}")
             return None
     
-    async def _handle_message_event(self, event: dict) -> Optional[dict]:
+    async def _handle_message_event(
+        self,
+        event: dict,
+        client: SlackBotClient,
+        chatbot_settings: Optional[Dict[str, Any]]
+    ) -> Optional[dict]:
         """Handle message events from Slack"""
         try:
             channel = event.get("channel")
@@ -91,8 +142,8 @@ class SlackIntegrationHandler:
             
             # Create settings from stored configuration
             settings = None
-            if self._chatbot_settings:
-                settings = ChatbotSettings(**self._chatbot_settings)
+            if chatbot_settings:
+                settings = ChatbotSettings(**chatbot_settings)
             else:
                 # Use default settings
                 settings = ChatbotSettings()
@@ -107,7 +158,7 @@ class SlackIntegrationHandler:
             )
             
             # Send response back to Slack
-            await self._send_bot_message(channel, response, thread_ts)
+            await self._send_bot_message(client, channel, response, thread_ts)
             
             return {"status": "processed"}
             
@@ -115,12 +166,8 @@ class SlackIntegrationHandler:
             logger.error(f"Error handling message event: {str(e)}")
             return None
     
-    async def _send_bot_message(self, channel: str, text: str, thread_ts: Optional[str] = None) -> bool:
-        """Send message using bot token"""
-        if not self._bot_token:
-            logger.error("Bot token not configured")
-            return False
-            
+    async def _send_bot_message(self, client: SlackBotClient, channel: str, text: str, thread_ts: Optional[str] = None) -> bool:
+        """Send message using the client's bot token"""
         try:
             session = await self._get_session()
             
@@ -132,15 +179,10 @@ class SlackIntegrationHandler:
             if thread_ts:
                 payload["thread_ts"] = thread_ts
             
-            headers = {
-                "Authorization": f"Bearer {self._bot_token}",
-                "Content-Type": "application/json"
-            }
-            
             async with session.post(
                 "https://slack.com/api/chat.postMessage",
                 json=payload,
-                headers=headers
+                headers=client.headers
             ) as response:
                 data = await response.json()
                 return data.get("ok", False)
@@ -219,23 +261,13 @@ class SlackIntegrationHandler:
         except Exception as e:
             logger.error(f"Error sending Slack message: {str(e)}")
             return False
-    
-    async def close(self):
-        """Close the aiohttp session"""
-        if self.session and not self.session.closed:
-            await self.session.close()
 
 class DiscordIntegrationHandler:
     """Handler for Discord integrations"""
     
-    def __init__(self):
-        self.session = None
-    
     async def _get_session(self) -> aiohttp.ClientSession:
-        """Get or create an aiohttp session"""
-        if self.session is None or self.session.closed:
-            self.session = aiohttp.ClientSession()
-        return self.session
+        """Get the shared aiohttp session"""
+        return await get_http_session()
     
     async def validate_webhook(self, webhook_url: str) -> bool:
         """
@@ -297,23 +329,13 @@ class DiscordIntegrationHandler:
         except Exception as e:
             logger.error(f"Error sending Discord message: {str(e)}")
             return False
-    
-    async def close(self):
-        """Close the aiohttp session"""
-        if self.session and not self.session.closed:
-            await self.session.close()
 
 class WebsiteIntegrationHandler:
     """Handler for Website integrations with custom domains"""
     
-    def __init__(self):
-        self.session = None
-    
     async def _get_session(self) -> aiohttp.ClientSession:
-        """Get or create an aiohttp session"""
-        if self.session is None or self.session.closed:
-            self.session = aiohttp.ClientSession()
-        return self.session
+        """Get the shared aiohttp session"""
+        return await get_http_session()
     
     def generate_verification_token(self, domain: str) -> str:
         """Generate a unique verification token for DNS verification"""
@@ -423,11 +445,6 @@ class WebsiteIntegrationHandler:
         except Exception as e:
             logger.error(f"Error checking domain setup for {domain}: {str(e)}")
             return False
-    
-    async def close(self):
-        """Close the aiohttp session"""
-        if self.session and not self.session.closed:
-            await self.session.close()
 
 # Create global instances
 slack_handler = SlackIntegrationHandler()
@@ -3,6 +3,7 @@ import logging
 import json
 from datetime import datetime
 
+import httpx
 from llama_index.llms.groq import Groq
 from llama_index.core import Settings
 
@@ -11,6 +12,31 @@ from ..models.chatbot import ChatbotSettings, ChatMessage
 
 logger = logging.getLogger(__name__)
 
+# Pooled HTTP clients shared by every Groq LLM instance, so per-request
+# temperature/model overrides don't each open new connections
+_LLM_HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+_LLM_HTTP_TIMEOUT = httpx.Timeout(30, connect=5)
+_llm_http_client = httpx.Client(http2=True, limits=_LLM_HTTP_LIMITS, timeout=_LLM_HTTP_TIMEOUT)
+_llm_async_http_client = httpx.AsyncClient(http2=True, limits=_LLM_HTTP_LIMITS, timeout=_LLM_HTTP_TIMEOUT)
+
+async def close_llm_clients():
+    """Close the pooled LLM HTTP clients on shutdown"""
+    _llm_http_client.close()
+    await _llm_async_http_client.aclose()
+
+def create_llm(temperature: Optional[float] = None,
+               max_tokens: Optional[int] = None,
+               model: Optional[str] = None) -> Groq:
+    """Create a Groq LLM backed by the shared connection pool"""
+    return Groq(
+        api_key=settings.GROQ_API_KEY,
+        model=model or settings.LLM_MODEL,
+        max_tokens=max_tokens or settings.LLM_MAX_TOKENS,
+        temperature=temperature if temperature is not None else settings.LLM_TEMPERATURE,
+        http_client=_llm_http_client,
+        async_http_client=_llm_async_http_client
+    )
+
 class LLMService:
     def __init__(self, temperature: Optional[float] = None, max_tokens: Optional[int] = None, model: Optional[str] = None):
         """Initialize the LLM service with Groq"""
@@ -20,12 +46,7 @@ class LLMService:
         
         # Initialize Groq LLM
         try:
-            self.llm = Groq(
-                api_key=settings.GROQ_API_KEY,
-                model=self.model,
-                max_tokens=self.max_tokens,
-                temperature=self.temperature
-            )
+            self.llm = create_llm(self.temperature, self.max_tokens, self.model)
             logger.info(f"Initialized Groq LLM with model: {self.model}")
         except Exception as e:
             logger.error(f"Failed to initialize Groq LLM: {str(e)}")
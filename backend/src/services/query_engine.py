@@ -1,7 +1,9 @@
 import os
+import asyncio
 import logging
 import traceback
-from typing import List, Dict, Any, Optional, Union, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Union, Tuple, AsyncIterator
 import json
 
 from llama_index.core import VectorStoreIndex, Settings
@@ -9,7 +11,6 @@ from llama_index.core.vector_stores.types import VectorStore
 from llama_index.core.retrievers import VectorIndexRetriever
 from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.core.postprocessor import SimilarityPostprocessor
-from llama_index.llms.groq import Groq
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.vector_stores.milvus import MilvusVectorStore
 from llama_index.vector_stores.qdrant import QdrantVectorStore
@@ -19,13 +20,27 @@ from dotenv import load_dotenv
 from qdrant_client import QdrantClient
 
 from ..core.config import settings as app_settings
-from ..db.firebase import FirestoreDB
+from ..db.firebase import get_firestore_db
 from ..db.vector_store import get_vector_db
+from .llm import create_llm
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Retrieval embeds the query on the CPU and the sync query engine blocks on
+# HTTP, so both run here instead of on the event loop. Bounded so a burst of
+# chat requests can't oversubscribe the CPU.
+_query_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("QUERY_ENGINE_WORKERS", "8")),
+    thread_name_prefix="query-engine"
+)
+
+async def _run_blocking(func, *args):
+    """Run a blocking call on the query engine worker pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_query_executor, func, *args)
+
 class RAGStatus:
     """Constants for RAG status"""
     SUCCESS = "rag_success"
@@ -36,16 +51,12 @@ class RAGStatus:
 
 class QueryEngine:
     def __init__(self):
-        self.firestore = FirestoreDB()
+        self.firestore = get_firestore_db()
         self.vector_db = get_vector_db()
         self.last_sources = []
         
         # Initialize LLM
-        self.llm = Groq(
-            model=app_settings.LLM_MODEL,
-            max_tokens=app_settings.LLM_MAX_TOKENS,
-            temperature=app_settings.LLM_TEMPERATURE
-        )
+        self.llm = create_llm()
         
         # Initialize embedding model - renamed from embed_model to embeddings
         self.embeddings = HuggingFaceEmbedding(
@@ -56,6 +67,10 @@ class QueryEngine:
         Settings.llm = self.llm
         Settings.embed_model = self.embeddings
     
+    async def warm(self) -> None:
+        """Run one embedding so model weights are loaded before traffic arrives"""
+        await _run_blocking(self.embeddings.get_text_embedding, "warmup")
+    
     async def create_service_context(self, temperature: Optional[float] = None):
         """Create settings with custom temperature
         
@@ -67,12 +82,7 @@ class QueryEngine:
         """
         # Use custom temperature if provided
         if temperature is not None:
-            llm = Groq(
-                model=app_settings.LLM_MODEL,
-                max_tokens=app_settings.LLM_MAX_TOKENS,
-                temperature=temperature
-            )
-            Settings.llm = llm
+            Settings.llm = create_llm(temperature)
         else:
             Settings.llm = self.llm
         
@@ -164,7 +174,7 @@ class QueryEngine:
                 
                 # Execute query
                 logger.info("Executing query with vector search")
-                response = query_engine.query(query)
+                response = await _run_blocking(query_engine.query, query)
                 logger.info(f"Raw query response: {response}")
                 
                 # Extract source documents
@@ -237,6 +247,106 @@ class QueryEngine:
                 logger.error(f"Fallback error traceback: {traceback.format_exc()}")
                 return "I apologize, but I encountered an unexpected error. Please try again later.", [], 0, RAGStatus.ERROR
     
+    async def stream_query(self,
+                           query: str,
+                           document_ids: Optional[List[str]] = None,
+                           temperature: Optional[float] = None,
+                           instructions: Optional[str] = None,
+                           max_tokens: Optional[int] = None,
+                           model: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Query the chatbot, yielding the response as it is generated
+        
+        Retrieval runs up front; only the LLM decode is streamed.
+        
+        Args:
+            query: Query text
+            document_ids: Optional list of document IDs to search
+            temperature: Optional temperature override
+            instructions: Optional instructions
+            max_tokens: Optional max tokens override
+            model: Optional model override
+            
+        Yields:
+            {"token": str} for each generated chunk, then a final
+            {"done": True, "response", "sources", "tokens", "rag_status"} event
+        """
+        sources: List[Dict[str, Any]] = []
+        context = None
+        rag_status = RAGStatus.NO_DOCUMENTS
+        
+        if document_ids:
+            try:
+                vector_store = await self._create_vector_store_for_documents(document_ids)
+                index = VectorStoreIndex.from_vector_store(vector_store)
+                
+                # Same retrieval parameters as query()
+                complexity = self._assess_query_complexity(query)
+                similarity_top_k, similarity_cutoff = {
+                    "high": (8, 0.5),
+                    "medium": (5, 0.55)
+                }.get(complexity, (3, 0.6))
+                
+                retriever = VectorIndexRetriever(index=index, similarity_top_k=similarity_top_k)
+                nodes = await _run_blocking(retriever.retrieve, query)
+                nodes = SimilarityPostprocessor(similarity_cutoff=similarity_cutoff).postprocess_nodes(nodes)
+                
+                for node in nodes:
+                    sources.append({
+                        "document_id": node.node.metadata.get("document_id"),
+                        "chunk_id": node.node.metadata.get("chunk_id"),
+                        "score": node.score
+                    })
+                if nodes:
+                    context = "\n\n".join(node.get_content() for node in nodes)
+                    rag_status = RAGStatus.SUCCESS
+                else:
+                    rag_status = RAGStatus.NO_RESULTS
+            except Exception as vector_error:
+                logger.error(f"Vector search error: {str(vector_error)}")
+                logger.error(f"Vector search traceback: {traceback.format_exc()}")
+                rag_status = RAGStatus.ERROR
+        
+        if context:
+            system_prompt = self._build_system_prompt(instructions)
+            system_prompt = f"{system_prompt}\n\nContext:\n{context}"
+        else:
+            system_prompt = self._build_llm_only_prompt(instructions)
+        
+        messages = [
+            ChatMessage(role=MessageRole.SYSTEM, content=system_prompt),
+            ChatMessage(role=MessageRole.USER, content=query)
+        ]
+        llm = create_llm(temperature, max_tokens, model)
+        
+        parts = []
+        if rag_status == RAGStatus.NO_RESULTS:
+            prefix = "I couldn't find specific information about that in the knowledge base. "
+            parts.append(prefix)
+            yield {"token": prefix}
+        
+        try:
+            async for chunk in await llm.astream_chat(messages):
+                if chunk.delta:
+                    parts.append(chunk.delta)
+                    yield {"token": chunk.delta}
+        except Exception as e:
+            logger.error(f"Error streaming LLM response: {str(e)}")
+            logger.error(f"Error traceback: {traceback.format_exc()}")
+            rag_status = RAGStatus.ERROR
+            if not parts:
+                message = "I apologize, but I encountered an unexpected error. Please try again later."
+                parts.append(message)
+                yield {"token": message}
+        
+        response_text = "".join(parts)
+        yield {
+            "done": True,
+            "response": response_text,
+            "sources": sources,
+            "tokens": len(query.split()) + len(response_text.split()),
+            "rag_status": rag_status
+        }
+    
     def _assess_query_complexity(self, query: str) -> str:
         """Assess query complexity to adjust retrieval parameters
         
@@ -330,15 +440,11 @@ class QueryEngine:
             logger.info(f"Using LLM temperature: {temp_value}")
             
             # Initialize the LLM with our configuration
-            llm = Groq(
-                model=app_settings.LLM_MODEL,
-                max_tokens=app_settings.LLM_MAX_TOKENS,
-                temperature=temp_value
-            )
+            llm = create_llm(temp_value)
             
             # Call LLM
             logger.info(f"Calling LLM with model: {app_settings.LLM_MODEL}")
-            response = llm.chat(messages)
+            response = await llm.achat(messages)
             logger.info(f"Received response from LLM: {type(response)}")
             
             # Extract response based on the type returned by the LLM
@@ -509,7 +615,7 @@ class QueryEngine:
                 
                 # Get nodes from the query
                 logger.info(f"Retrieving relevant nodes for query: '{query}'")
-                retrieved_nodes = retriever.retrieve(query)
+                retrieved_nodes = await _run_blocking(retriever.retrieve, query)
                 
                 # If no nodes found
                 if not retrieved_nodes:
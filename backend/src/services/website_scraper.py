@@ -1,11 +1,60 @@
 import aiohttp
+import asyncio
+import codecs
 import logging
-from typing import Dict, Any, Optional
-from ..utils.text_utils import clean_text, extract_text_from_html
+from html.parser import HTMLParser
+from typing import Dict, Any, List, Optional
+from ..utils.text_utils import clean_text
 from ..core.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Read pages in 64 KiB chunks and stop after 10 MiB of HTML
+SCRAPE_CHUNK_SIZE = 64 * 1024
+MAX_SCRAPE_BYTES = 10 * 1024 * 1024
+
+# Limit how many pages are fetched at once across all requests
+_scrape_semaphore = asyncio.Semaphore(8)
+
+class _PageTextParser(HTMLParser):
+    """Incremental HTML parser collecting visible text, the title and the meta description"""
+
+    _SKIPPED_TAGS = {"script", "style", "noscript", "template"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.text_parts: List[str] = []
+        self.title_parts: List[str] = []
+        self.description = ''
+        self._skip_depth = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        # Tags separate words; data for one text node may arrive split
+        # across chunk boundaries, so only tags insert whitespace
+        self.text_parts.append(' ')
+        if tag in self._SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag == "title":
+            self._in_title = True
+        elif tag == "meta" and not self.description:
+            attributes = dict(attrs)
+            if (attributes.get("name") or "").lower() == "description":
+                self.description = attributes.get("content") or ''
+
+    def handle_endtag(self, tag):
+        self.text_parts.append(' ')
+        if tag in self._SKIPPED_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag == "title":
+            self._in_title = False
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title_parts.append(data)
+        elif not self._skip_depth:
+            self.text_parts.append(data)
+
 class WebsiteScraper:
     def __init__(self):
         self.api_key = settings.FIRECRAWL_API_KEY
@@ -87,36 +136,37 @@ class WebsiteScraper:
             return None
             
     async def _scrape_directly(self, url: str) -> Optional[Dict[str, Any]]:
-        """Fallback method to scrape website directly"""
+        """Fallback method to scrape website directly
+        
+        The page is parsed as it streams in, so memory stays at one chunk
+        rather than the whole HTML document.
+        """
         try:
-            async with aiohttp.ClientSession() as session:
+            async with _scrape_semaphore, aiohttp.ClientSession() as session:
                 async with session.get(url, timeout=30) as response:
                     if response.status != 200:
                         logger.error(f"Failed to fetch URL directly: {response.status}")
                         return None
-                        
-                    html_content = await response.text()
                     
-                    # Extract text from HTML
-                    text_content = await extract_text_from_html(html_content)
-                    cleaned_content = await clean_text(text_content)
+                    parser = _PageTextParser()
+                    decoder = codecs.getincrementaldecoder(response.charset or 'utf-8')(errors='replace')
+                    bytes_read = 0
+                    async for chunk in response.content.iter_chunked(SCRAPE_CHUNK_SIZE):
+                        bytes_read += len(chunk)
+                        parser.feed(decoder.decode(chunk))
+                        if bytes_read >= MAX_SCRAPE_BYTES:
+                            logger.warning(f"Stopped reading {url} after {bytes_read} bytes")
+                            break
+                    parser.feed(decoder.decode(b'', final=True))
+                    parser.close()
                     
-                    # Try to extract title from HTML
-                    title = ''
-                    description = ''
-                    try:
-                        from bs4 import BeautifulSoup
-                        soup = BeautifulSoup(html_content, 'html.parser')
-                        title = soup.title.string if soup.title else ''
-                        meta_desc = soup.find('meta', attrs={'name': 'description'})
-                        description = meta_desc.get('content', '') if meta_desc else ''
-                    except Exception as e:
-                        logger.warning(f"Error extracting metadata: {str(e)}")
+                    cleaned_content = await clean_text(''.join(parser.text_parts))
+                    title = ' '.join(''.join(parser.title_parts).split())
                     
                     return {
                         'content': cleaned_content,
                         'title': title or url,
-                        'description': description,
+                        'description': parser.description,
                         'url': url,
                         'word_count': len(cleaned_content.split()),
                         'source_type': 'website'
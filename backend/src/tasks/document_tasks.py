@@ -1,7 +1,10 @@
+import asyncio
 import logging
-from datetime import datetime
-from typing import Optional
+import os
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List, Optional, Set
 
+from src.core.config import settings
 from src.db.firebase import firestore_db, storage
 from src.services.document_processor import DocumentProcessor
 
@@ -9,31 +12,30 @@ logger = logging.getLogger(__name__)
 
 async def process_document(document_id: str) -> dict:
     """
-    Process a document synchronously within the request cycle.
+    Process a document: parse, embed and index it, tracking status in Firestore.
     """
     logger.info(f"Starting processing for document ID: {document_id}")
 
     # Instantiate processor inside the task
     document_processor = DocumentProcessor()
+    claimed = False
 
     try:
-        # Get document from Firestore
-        logger.info(f"Getting document {document_id} from Firestore.")
-        doc = await firestore_db.get_document(document_id)
-        if not doc:
-            logger.error(f"Document {document_id} not found in Firestore.")
-            raise Exception(f"Document {document_id} not found")
-        logger.info(f"Document {document_id} found.")
-
-        # Update status to processing
-        logger.info(f"Updating document {document_id} status to 'processing'.")
-        await firestore_db.update_document(
+        # Claim the document by moving it to 'processing'. If it is missing,
+        # or another worker (or a retried job) already claimed or finished
+        # it, skip it. A document left in 'processing' by a lost job can be
+        # claimed again once it times out.
+        logger.info(f"Claiming document {document_id} for processing.")
+        claimed = await firestore_db.claim_document(
             document_id,
-            {
-                "processingStatus": "processing",
-                "updatedAt": datetime.utcnow().isoformat()
-            }
+            ("pending", "failed"),
+            {"processingStatus": "processing"},
+            stale_statuses=("processing",),
+            stale_after=settings.DOCUMENT_PROCESSING_TIMEOUT
         )
+        if not claimed:
+            logger.info(f"Document {document_id} is missing, already being processed or done; skipping.")
+            return {"documentId": document_id, "skipped": True}
         logger.info(f"Document {document_id} status updated to 'processing'.")
 
         # Process the document
@@ -48,6 +50,11 @@ async def process_document(document_id: str) -> dict:
     except Exception as e:
         logger.error(f"Error processing document {document_id}: {str(e)}", exc_info=True)
         
+        # Only the worker holding the claim may mark the document failed;
+        # otherwise a losing worker would clobber the winner's status
+        if not claimed:
+            raise e
+        
         # Simple error handling: update status to failed and re-raise
         try:
             await firestore_db.update_document(
@@ -55,7 +62,7 @@ async def process_document(document_id: str) -> dict:
                 {
                     "processingStatus": "failed",
                     "error": str(e),
-                    "updatedAt": datetime.utcnow().isoformat()
+                    "updatedAt": datetime.now(timezone.utc)
                 }
             )
             logger.info(f"Updated document {document_id} status to failed.")
@@ -63,4 +70,130 @@ async def process_document(document_id: str) -> dict:
             logger.error(f"Failed to update document {document_id} status to failed: {update_err}")
         
         # Re-raise the original exception so the caller knows something went wrong
-        raise e 
\ No newline at end of file
+        raise e
+
+async def reindex_document(document_id: str) -> Optional[dict]:
+    """
+    Re-process an already ingested document, replacing its embeddings.
+    """
+    logger.info(f"Starting reindex for document ID: {document_id}")
+    document_processor = DocumentProcessor()
+    # process_document_immediately marks the document failed on error
+    return await document_processor.process_document_immediately(document_id)
+
+class DocumentTaskQueue:
+    """In-process queue that runs a document task on a pool of worker coroutines.
+
+    Endpoints enqueue a document ID and return straight away; the workers
+    pick jobs up in order, at most `concurrency` at a time.
+
+    The queue only lives in memory. stop() puts the documents of jobs it
+    drops back to 'pending', and if `recover` is given, start() calls it and
+    queues the document IDs it returns, so those jobs are picked up again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[str], Awaitable[object]],
+        concurrency: int = 4,
+        recover: Optional[Callable[[], Awaitable[List[str]]]] = None
+    ):
+        self.name = name
+        self.handler = handler
+        self.concurrency = concurrency
+        self.recover = recover
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._recovery: Optional[asyncio.Task] = None
+        self._running: Set[str] = set()
+
+    def start(self) -> None:
+        """Start the worker coroutines on the running event loop"""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self.concurrency)
+        ]
+        if self.recover:
+            self._recovery = asyncio.create_task(self._recover())
+        logger.info(f"Started {self.concurrency} {self.name} workers")
+
+    async def stop(self) -> None:
+        """Cancel the workers, returning the documents of dropped jobs to 'pending'"""
+        # Note the running jobs first; cancelled workers drop them from the set
+        dropped = set(self._running)
+        tasks = self._workers + ([self._recovery] if self._recovery else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._recovery = None
+
+        # Running jobs were cancelled mid-way and queued reindexes were
+        # already claimed, so these documents sit in 'processing'. Reset
+        # them so the next start()'s recovery picks them up straight away.
+        while self._queue and not self._queue.empty():
+            dropped.add(self._queue.get_nowait())
+        results = await asyncio.gather(
+            *(firestore_db.claim_document(document_id, ("processing",), {"processingStatus": "pending"})
+              for document_id in dropped),
+            return_exceptions=True
+        )
+        for document_id, result in zip(dropped, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Failed to reset document {document_id} to pending: {str(result)}")
+
+    async def enqueue(self, document_id: str) -> None:
+        """Queue a document for processing
+
+        Args:
+            document_id: ID of a document already stored with status 'pending'
+        """
+        if not self._workers:
+            self.start()
+        await self._queue.put(document_id)
+        logger.info(f"Queued document {document_id} for {self.name} ({self._queue.qsize()} waiting)")
+
+    async def _recover(self) -> None:
+        try:
+            document_ids = await self.recover()
+        except Exception as e:
+            logger.error(f"Failed to list documents to recover for {self.name}: {str(e)}")
+            return
+        # Other instances may queue the same IDs; the handler's claim
+        # makes sure each document is only processed once
+        for document_id in document_ids:
+            await self._queue.put(document_id)
+        if document_ids:
+            logger.info(f"Re-queued {len(document_ids)} unfinished documents for {self.name}")
+
+    async def _worker(self, worker_id: int) -> None:
+        while True:
+            document_id = await self._queue.get()
+            self._running.add(document_id)
+            try:
+                await self.handler(document_id)
+            except Exception:
+                # The handler already logged the error and marked the document failed
+                pass
+            finally:
+                self._running.discard(document_id)
+                self._queue.task_done()
+
+# Shared queues used by the API and started with the application. Reindexing
+# gets its own pool so it can't starve fresh ingestion.
+task_queue = DocumentTaskQueue(
+    "document processing",
+    process_document,
+    concurrency=int(os.environ.get("DOCUMENT_WORKER_CONCURRENCY", 4)),
+    # Picks up pending documents and processing ones (including reindexes)
+    # whose job was lost in a restart
+    recover=lambda: firestore_db.list_unfinished_document_ids(settings.DOCUMENT_PROCESSING_TIMEOUT)
+)
+reindex_queue = DocumentTaskQueue(
+    "reindex",
+    reindex_document,
+    concurrency=int(os.environ.get("REINDEX_WORKER_CONCURRENCY", 2))
+)
@@ -0,0 +1,71 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from cachetools import TTLCache
+
+_MISSING = object()
+
+class AsyncTTLCache:
+    """Bounded in-process TTL cache with single-flight loading.
+
+    Concurrent misses for the same key share one loader call instead of
+    each issuing its own backend round-trip.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get a cached value without loading it
+
+        Args:
+            key: Cache key
+            default: Value returned when the key is missing or expired
+
+        Returns:
+            Cached value or default
+        """
+        return self._cache.get(key, default)
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store a value in the cache"""
+        self._cache[key] = value
+
+    def invalidate(self, key: Hashable) -> None:
+        """Drop a key from the cache"""
+        self._cache.pop(key, None)
+
+    def clear(self) -> None:
+        """Drop every cached value"""
+        self._cache.clear()
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """Get a cached value, loading it with fetch() on a miss
+
+        Args:
+            key: Cache key
+            fetch: Coroutine function that loads the value
+
+        Returns:
+            Cached or freshly loaded value. None results are not cached.
+        """
+        value = self._cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                # Another coroutine may have loaded it while we waited
+                value = self._cache.get(key, _MISSING)
+                if value is not _MISSING:
+                    return value
+
+                value = await fetch()
+                if value is not None:
+                    self._cache[key] = value
+                return value
+        finally:
+            if not lock.locked() and self._locks.get(key) is lock:
+                self._locks.pop(key, None)
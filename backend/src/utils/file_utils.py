@@ -51,6 +51,48 @@ async def validate_file_type(file: UploadFile) -> bool:
     # Check if extension is supported
     return file_ext in SUPPORTED_FILE_TYPES
 
+# Leading bytes that identify binary upload formats
+FILE_SIGNATURES = {
+    'pdf': (b'%PDF-',),
+    # DOCX is a ZIP container
+    'docx': (b'PK\x03\x04',),
+}
+
+async def content_matches_extension(file: UploadFile, sniff_size: int = 4096) -> bool:
+    """Check that a file's leading bytes match its extension
+    
+    PDF and DOCX must start with their format signature; TXT must be
+    free of NUL bytes and decode as UTF-8. Only the first sniff_size
+    bytes are read, and the file is rewound afterwards.
+    
+    Args:
+        file: The uploaded file
+        sniff_size: Number of bytes to inspect
+        
+    Returns:
+        True if the content looks like the extension says, False otherwise
+    """
+    file_ext = file.filename.rsplit('.', 1)[-1].lower() if file.filename else ''
+    
+    await file.seek(0)
+    head = await file.read(sniff_size)
+    await file.seek(0)
+    
+    if file_ext in FILE_SIGNATURES:
+        return head.startswith(FILE_SIGNATURES[file_ext])
+    
+    if file_ext == 'txt':
+        if b'\x00' in head:
+            return False
+        try:
+            head.decode('utf-8')
+        except UnicodeDecodeError as e:
+            # A multi-byte character may be cut off at the end of the sample
+            return e.start >= len(head) - 3
+        return True
+    
+    return False
+
 async def get_file_size(file: UploadFile) -> int:
     """Get the size of an uploaded file
     